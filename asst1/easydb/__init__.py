@@ -7,6 +7,14 @@
 
 # exported functions and classes
 from .easydb import Database
+from .aio import AsyncDatabase
+from .pool import ConnectionPool
+from .pipeline import Pipeline
+from .cache import RowCache, ScanCache
+from .stats import Metrics
 from .packet import operator
 from .exception import *
 
+# the test server is not imported here, so python3 -m easydb.server runs it
+# cleanly, use: from easydb.server import Server
+
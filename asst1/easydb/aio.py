@@ -0,0 +1,312 @@
+#!/usr/bin/python3
+#
+# aio.py
+#
+# Definition for the AsyncDatabase class, an asyncio client for EasyDB
+#
+import asyncio
+import struct
+from time import perf_counter
+from .packet import *
+from .exception import *
+from .easydb import Database
+from .connection import INT_STRUCT, OK_SIZE
+
+# read one whole response to command from an asyncio stream
+async def read_response(reader, command):
+    frame = bytearray(await reader.readexactly(4))
+    code, = INT_STRUCT.unpack_from(frame)
+    if code != OK or command is None:
+        return frame
+    frame += await reader.readexactly(OK_SIZE[command])
+    if command == SCAN:
+        count, = INT_STRUCT.unpack_from(frame, 4)
+        frame += await reader.readexactly(8 * count)
+    elif command == GET:
+        count, = INT_STRUCT.unpack_from(frame, 12)
+        for _ in range(count):
+            header = await reader.readexactly(8)
+            c_size, = INT_STRUCT.unpack_from(header, 4)
+            frame += header
+            frame += await reader.readexactly(c_size)
+    return frame
+
+# await the coroutines of requests, requests that could not be built are
+# given as their PacketError. Returns a list of the results, None where the
+# request failed, and a dict from index to the error of that request.
+async def gather_many(requests):
+    coros = [request for request in requests if not isinstance(request, Exception)]
+    responses = iter(await asyncio.gather(*coros, return_exceptions=True))
+    results = [None] * len(requests)
+    errors = {}
+    for i, request in enumerate(requests):
+        result = request if isinstance(request, Exception) else next(responses)
+        if isinstance(result, Exception):
+            errors[i] = result
+        elif isinstance(result, BaseException):
+            raise result
+        else:
+            results[i] = result
+    return results, errors
+
+class AsyncDatabase(Database):
+
+    # schema validation, request building and response decoding are shared
+    # with Database, only the network calls are coroutines. Requests from
+    # concurrent tasks are pipelined on the one connection.
+    def __init__(self, tables):
+        super().__init__(tables)
+        self._reader = None
+        self._writer = None
+        # (command, decode, future, table_name, packet size, encode time,
+        #  send time) in send order
+        self._pending = None
+        self._read_task = None
+
+    def __repr__(self):
+        return "<EasyDB AsyncDatabase object>"
+
+    async def connect(self, host, port):
+        try:
+            self._reader, self._writer = await asyncio.open_connection(
+                host, int(port))
+            recv_code, = INT_STRUCT.unpack(await read_response(self._reader, None))
+            if recv_code == SERVER_BUSY:
+                await self._disconnect()
+                return False
+        except Exception as e:
+            await self._disconnect()
+            return False
+        self._pending = asyncio.Queue()
+        self._read_task = asyncio.ensure_future(self._read_loop())
+        return True
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.write(struct.pack('>ii', EXIT, 1))
+            await self._disconnect()
+
+    async def _disconnect(self):
+        if self._read_task is not None:
+            task = self._read_task
+            self._read_task = None
+            task.cancel()
+            # the reader fails the requests still waiting for a response
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        if self._writer is not None:
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except OSError:
+                pass
+        self._reader = self._writer = None
+
+    # match responses to requests in the order they were sent
+    async def _read_loop(self):
+        future = None
+        try:
+            while True:
+                command, decode, future, table_name, size, encode, sent = \
+                    await self._pending.get()
+                if decode is None and not future.cancelled():
+                    # scan_iter reads this response itself, the next one is
+                    # read once it is done
+                    done = asyncio.get_running_loop().create_future()
+                    future.set_result(done)
+                    await done
+                    continue
+                frame = await read_response(self._reader, command)
+                received = perf_counter()
+                if future.cancelled():
+                    continue
+                try:
+                    future.set_result(decode(frame))
+                except Exception as e:
+                    future.set_exception(e)
+                # network time includes waiting behind earlier requests
+                self._record(command, table_name, size, frame,
+                             encode, received - sent, perf_counter() - received)
+        except (OSError, asyncio.IncompleteReadError) as e:
+            self._fail_pending(future, e)
+        except asyncio.CancelledError:
+            # closed with requests in flight
+            self._fail_pending(future, None)
+            raise
+
+    # fail future, the request being read, and every request still queued
+    # with ConnectionError
+    def _fail_pending(self, future, cause):
+        error = ConnectionError()
+        error.__cause__ = cause
+        failed = [future]
+        while not self._pending.empty():
+            failed.append(self._pending.get_nowait()[2])
+        for future in failed:
+            if future is not None and not future.done():
+                future.set_exception(error)
+
+    async def _request(self, command, packet, decode, table_name=None, started=None):
+        if self._writer is None or self._read_task is None or self._read_task.done():
+            raise ConnectionError
+        future = asyncio.get_running_loop().create_future()
+        sent = perf_counter()
+        # write and queue without awaiting in between to keep them in order
+        self._writer.write(packet)
+        self._pending.put_nowait((command, decode, future, table_name,
+                                  len(packet), sent - (started or sent), sent))
+        await self._writer.drain()
+        return await future
+
+    async def insert(self, table_name, values):
+        started = perf_counter()
+        packet = self._insert_request(table_name, values)
+        return await self._request(INSERT, packet,
+                                   self._insert_decoder(table_name, values),
+                                   table_name, started)
+
+    # insert every row in rows, the requests are pipelined on the connection.
+    # Returns a list with the (pk, version) of each row, None for the rows
+    # that failed, and a dict from row index to the error for that row.
+    # batch_size is not used, writes wait for the connection to drain.
+    async def insert_many(self, table_name, rows, batch_size=MAX_PACKET_SIZE):
+        if table_name not in self.tablesInfo.keys():
+            raise PacketError
+        requests = []
+        for values in rows:
+            try:
+                packet = self._insert_request(table_name, values)
+            except PacketError as e:
+                requests.append(e)
+                continue
+            requests.append(self._request(INSERT, packet,
+                                          self._insert_decoder(table_name, values),
+                                          table_name))
+        return await gather_many(requests)
+
+    async def update(self, table_name, pk, values, version=0):
+        started = perf_counter()
+        packet = self._update_request(table_name, pk, values, version)
+        return await self._request(UPDATE, packet,
+                                   self._update_decoder(table_name, pk, values),
+                                   table_name, started)
+
+    # update every (pk, values, version) in rows, as insert_many. Returns a
+    # list with the new version of each row, None for the rows that failed,
+    # and a dict from row index to the error for that row.
+    async def update_many(self, table_name, rows, batch_size=MAX_PACKET_SIZE):
+        if table_name not in self.tablesInfo.keys():
+            raise PacketError
+        requests = []
+        for pk, values, version in rows:
+            try:
+                packet = self._update_request(table_name, pk, values, version)
+            except PacketError as e:
+                requests.append(e)
+                continue
+            requests.append(self._request(UPDATE, packet,
+                                          self._update_decoder(table_name, pk, values),
+                                          table_name))
+        return await gather_many(requests)
+
+    async def drop(self, table_name, pk):
+        started = perf_counter()
+        packet = self._drop_request(table_name, pk)
+        return await self._request(DROP, packet,
+                                   self._drop_decoder(table_name, pk),
+                                   table_name, started)
+
+    async def get(self, table_name, pk):
+        started = perf_counter()
+        packet = self._get_request(table_name, pk)
+        if self.cache is not None:
+            cached = self.cache.get(table_name, pk)
+            if cached is not None:
+                return cached
+        return await self._request(GET, packet,
+                                   self._get_decoder(table_name, pk),
+                                   table_name, started)
+
+    async def get_many(self, table_name, pks, skip_missing=False):
+        results = await asyncio.gather(*[self.get(table_name, pk) for pk in pks],
+                                       return_exceptions=True)
+        for i, result in enumerate(results):
+            if isinstance(result, BaseException):
+                if not (skip_missing and isinstance(result, ObjectDoesNotExist)):
+                    raise result
+                results[i] = None
+        return results
+
+    async def scan(self, table_name, op, column_name=None, value=None):
+        started = perf_counter()
+        packet = self._scan_request(table_name, op, column_name, value)
+        if self.scan_cache is not None:
+            cached = self.scan_cache.get(table_name, packet)
+            if cached is not None:
+                return cached
+        return await self._request(SCAN, packet,
+                                   self._scan_decoder(table_name, packet),
+                                   table_name, started)
+
+    # concurrent requests are already pipelined, use asyncio.gather instead
+    def pipeline(self, batch_size=MAX_PACKET_SIZE):
+        raise NotImplementedError
+
+    # Yields the ids found by a scan as they are read, chunk ids at a time.
+    # The reader task waits while the response is read here, so requests
+    # sent meanwhile are answered after the scan has been read through.
+    async def scan_iter(self, table_name, op, column_name=None, value=None, chunk=1024):
+        if chunk < 1:
+            raise ValueError
+        started = perf_counter()
+        packet = self._scan_request(table_name, op, column_name, value)
+        encode = perf_counter() - started
+        done = await self._request(SCAN, packet, None, table_name, started)
+        reader = self._reader
+        sent = perf_counter()
+        remaining = None    # bytes of ids not read yet, None before the count
+        try:
+            recv_code, = INT_STRUCT.unpack(await reader.readexactly(4))
+            if recv_code != OK:
+                remaining = 0
+                self.metrics.record(SCAN, table_name, recv_code, len(packet),
+                                    4, encode, perf_counter() - sent, 0.)
+                self.errorCheck(recv_code)
+                return
+            count, = INT_STRUCT.unpack(await reader.readexactly(4))
+            remaining = 8 * count
+            received = 8 + remaining
+            decode = 0.
+            while remaining > 0:
+                data = await reader.readexactly(min(8 * chunk, remaining))
+                unpacked = perf_counter()
+                ids = struct.unpack('>%dq' % (len(data) // 8), data)
+                decode += perf_counter() - unpacked
+                remaining -= len(data)
+                for pk in ids:
+                    yield pk
+            # time spent by the consumer between chunks counts as network
+            self.metrics.record(SCAN, table_name, OK, len(packet), received,
+                                encode, perf_counter() - sent - decode, decode)
+        except (OSError, asyncio.IncompleteReadError) as e:
+            # the reader task fails the other requests
+            if not done.done():
+                done.set_exception(e)
+            raise ConnectionError from e
+        finally:
+            if not done.done():
+                if remaining is None:
+                    # interrupted before the count was read
+                    done.set_exception(ConnectionError())
+                else:
+                    try:
+                        if remaining > 0:
+                            # stopped early, skip the rest of the ids to keep
+                            # the stream in sync
+                            await reader.readexactly(remaining)
+                    except BaseException:
+                        done.set_exception(ConnectionError())
+                        raise
+                    done.set_result(None)
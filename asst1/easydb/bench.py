@@ -0,0 +1,344 @@
+#!/usr/bin/python3
+#
+# bench.py
+#
+# Offline micro-benchmarks for the EasyDB client, run from asst1 with
+#   python3 -m easydb.bench [--quick] [--output FILE] [--baseline FILE]
+#
+# Measures value and row encoding, GET response decoding and SCAN id
+# decoding without a server, and prints the results as JSON.
+#
+import argparse
+import json
+import platform
+import struct
+import sys
+import time
+import timeit
+import tracemalloc
+from .packet import *
+from .easydb import Database
+
+# the tables of asst1/main.py
+USER_ACCOUNT = (
+    ("User", (
+        ("firstName", str),
+        ("lastName", str),
+        ("height", float),
+        ("age", int),
+    )),
+    ("Account", (
+        ("user", "User"),
+        ("type", str),
+        ("balance", float),
+    )),
+)
+
+ROWS = (1, 100, 1000)           # rows encoded or decoded per operation
+STRLENS = (4, 16, 64)           # characters in each string value
+WIDE_COLUMNS = (10, 50)         # columns of the synthetic wide tables
+SCAN_COUNTS = (10, 1000, 10000) # ids in a SCAN response
+TARGET = 100000                 # values (or ids) handled per timing run
+
+# GET decoding before RowCodec, it slices off the rest of the response once
+# per column and is kept here to measure against
+def legacy_get_response(recv_response):
+    info_list = struct.unpack_from('>iqi', recv_response, 0)
+    version = info_list[1]
+    cut_1 = struct.calcsize('>i')*2 + struct.calcsize('>q') #iqi
+    remain = recv_response[cut_1:]
+    count = info_list[2]
+    result_list=[]
+
+    while count >0:
+        cut_2 = struct.calcsize('>i')*2
+        c_type,c_size,= struct.unpack_from('>ii', remain[:cut_2], 0)
+        fmt = '>ii'+'%ds'%c_size
+        temp = remain[:cut_2+c_size]
+        c_type, c_size,value = struct.unpack_from(fmt, temp, 0)
+
+        if c_type == STRING:
+            value = value.rstrip(b'\x00')
+            dec_val = value.decode('ascii')
+        elif c_type == FLOAT:
+            dec_val, = struct.unpack_from('>d',value)
+        elif c_type == INTEGER or c_type == FOREIGN:
+            dec_val, = struct.unpack_from('>q',value)
+
+        result_list.append(dec_val)
+        remain = remain[cut_2+c_size:]
+        count-=1
+
+    return result_list,version
+
+# the OK response to GET that the server sends for values of a table
+def get_response(values, version=1, codes=None):
+    parts = [struct.pack('>iqi', OK, version, len(values))]
+    for i, value in enumerate(values):
+        if type(value) is str:
+            data = value.encode('ascii')
+            data += b'\x00' * (-len(data) % 4)
+            parts.append(struct.pack('>ii', STRING, len(data)) + data)
+        elif type(value) is float:
+            parts.append(struct.pack('>iid', FLOAT, 8, value))
+        else:
+            code = INTEGER if codes is None else codes[i]
+            parts.append(struct.pack('>iiq', code, 8, value))
+    return b''.join(parts)
+
+# the OK response to SCAN that the server sends for ids
+def scan_response(ids):
+    return struct.pack('>ii%dq' % len(ids), OK, len(ids), *ids)
+
+# schema with a single table of columns columns of type colType, or of
+# str, int and float in turn for colType None
+def wide_table(columns, colType=str):
+    kinds = (str, int, float)
+    return (("Wide", [("c%d"%i, colType or kinds[i % 3]) for i in range(columns)]),)
+
+# a row of table with strings of strlen characters, foreign keys refer to 1
+def sample_row(db, table_name, strlen, seed=0):
+    row = []
+    for i, (name, colType) in enumerate(db.tablesInfo[table_name]):
+        if colType is str:
+            row.append(chr(ord('a') + (seed + i) % 26) * strlen)
+        elif colType is float:
+            row.append(seed + i + .5)
+        else:
+            row.append(seed + i + 1)
+    return row
+
+# operations per second of func, best of repeat runs
+def ops_per_sec(func, number, repeat=3):
+    return number / min(timeit.repeat(func, number=number, repeat=repeat))
+
+# memory blocks and peak bytes allocated by one call of func, the result of
+# func is kept alive while the blocks are counted
+def allocations(func):
+    func()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+        start, _ = tracemalloc.get_traced_memory()
+        result = func()
+        _, peak = tracemalloc.get_traced_memory()
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    del result
+    stats = after.compare_to(before, 'filename')
+    blocks = sum([stat.count_diff for stat in stats
+                  if stat.traceback[0].filename != tracemalloc.__file__])
+    return blocks, peak - start
+
+# time func, which handles size rows (or ids) of width values per call, and
+# measure its allocations. ops are rows per second, allocations are per row.
+def measure(func, size, width=1, target=TARGET, repeat=3):
+    number = max(1, target // (size * width))
+    blocks, peak = allocations(func)
+    return {
+        'ops_per_sec': ops_per_sec(func, number, repeat) * size,
+        'alloc_blocks_per_op': blocks / size,
+        'alloc_bytes_per_op': peak / size,
+    }
+
+# the benchmarks of a table at one string length and row count, as
+# (name, func) where func returns what it decoded or encoded
+
+def encode_cases(db, table_name, strlen, rows):
+    values = [sample_row(db, table_name, strlen, seed) for seed in range(rows)]
+    columns = range(len(db.tablesInfo[table_name]))
+
+    def value_struct():
+        return [[db.valueStruct(table_name, row[i], i) for i in columns]
+                for row in values]
+
+    def row_struct():
+        return [db.rowStruct(table_name, row) for row in values]
+
+    yield 'encode.valueStruct', value_struct
+    yield 'encode.rowStruct', row_struct
+
+def decode_cases(db, table_name, strlen, rows):
+    values = [sample_row(db, table_name, strlen, seed) for seed in range(rows)]
+    codes = db.codecs[table_name].codes
+    responses = [memoryview(get_response(row, seed + 1, codes))
+                 for seed, row in enumerate(values)]
+    decode = db._get_decoder(table_name)
+    assert decode(responses[-1]) == (values[-1], rows)
+
+    def codec():
+        return [decode(response) for response in responses]
+
+    def offset():
+        return [db._get_response(response) for response in responses]
+
+    def legacy():
+        return [legacy_get_response(response) for response in responses]
+
+    yield 'decode.get', codec
+    yield 'decode.get.offset', offset
+    yield 'decode.get.legacy', legacy
+
+def scan_cases(db, count):
+    response = memoryview(scan_response(list(range(1, count + 1))))
+    assert db._scan_response(response) == list(range(1, count + 1))
+    # scan_iter reads from a pool connection, served the response here
+    db.pool = CannedPool(response)
+    table_name = USER_ACCOUNT[0][0]
+    packet = db._scan_request(table_name, operator.AL)
+    assert list(db._scan_ids(table_name, packet, 1024, 0.)) == list(range(1, count + 1))
+
+    def scan():
+        return db._scan_response(response)
+
+    # the chunk loop of scan_iter, 1024 ids at a time
+    def scan_iter():
+        return list(db._scan_ids(table_name, packet, 1024, 0.))
+
+    yield 'decode.scan', scan
+    yield 'decode.scan.chunked', scan_iter
+
+# stands in for a connection to the server, every request is answered with
+# the same response
+class CannedConnection:
+
+    def __init__(self, response):
+        self.response = response
+        self._start = 0
+
+    def __repr__(self):
+        return "<EasyDB CannedConnection object>"
+
+    def send(self, data):
+        self._start = 0
+
+    def read(self, size):
+        start = self._start
+        self._start += size
+        return self.response[start:start + size]
+
+# a pool of the one CannedConnection
+class CannedPool:
+
+    def __init__(self, response):
+        self.conn = CannedConnection(response)
+
+    def __repr__(self):
+        return "<EasyDB CannedPool object>"
+
+    def acquire(self, timeout=None):
+        return self.conn
+
+    def release(self, conn, discard=False):
+        pass
+
+# the schemas benchmarked, name -> tables
+def schemas(wide_columns=WIDE_COLUMNS):
+    result = {'user_account': USER_ACCOUNT}
+    for columns in wide_columns:
+        for colType, kind in ((str, 'str'), (int, 'int'), (None, 'mixed')):
+            result['wide_%s_%d' % (kind, columns)] = wide_table(columns, colType)
+    return result
+
+def run(rows=ROWS, strlens=STRLENS, wide_columns=WIDE_COLUMNS,
+        scan_counts=SCAN_COUNTS, target=TARGET, repeat=3, only=None):
+    results = []
+
+    def add(name, params, func, size, width=1):
+        if only is not None and not any(pattern in name for pattern in only):
+            return
+        entry = {'name': name}
+        entry.update(params)
+        entry.update(measure(func, size, width, target, repeat))
+        results.append(entry)
+
+    for schema, tables in schemas(wide_columns).items():
+        db = Database(tables)
+        for table_name, columns in tables:
+            has_str = any(colType is str for name, colType in columns)
+            for strlen in strlens if has_str else strlens[:1]:
+                for size in rows:
+                    params = {
+                        'schema': schema,
+                        'table': table_name,
+                        'columns': len(columns),
+                        'strlen': strlen if has_str else 0,
+                        'rows': size,
+                    }
+                    for name, func in encode_cases(db, table_name, strlen, size):
+                        add(name, params, func, size, len(columns))
+                    for name, func in decode_cases(db, table_name, strlen, size):
+                        add(name, params, func, size, len(columns))
+
+    db = Database(USER_ACCOUNT)
+    for count in scan_counts:
+        for name, func in scan_cases(db, count):
+            add(name, {'ids': count}, func, count)
+
+    return {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'machine': platform.machine(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'results': results,
+    }
+
+# identifies the same benchmark across two reports
+def result_key(entry):
+    return tuple(sorted((k, v) for k, v in entry.items()
+                        if k not in ('ops_per_sec', 'alloc_blocks_per_op',
+                                     'alloc_bytes_per_op')))
+
+# benchmarks of report that are slower than in baseline by more than
+# tolerance, or allocate more blocks per op
+def regressions(report, baseline, tolerance=.2):
+    previous = {result_key(entry): entry for entry in baseline['results']}
+    found = []
+    for entry in report['results']:
+        before = previous.get(result_key(entry))
+        if before is None:
+            continue
+        slower = entry['ops_per_sec'] < before['ops_per_sec'] * (1 - tolerance)
+        # allow for rounding of blocks shared by rows
+        allocs = entry['alloc_blocks_per_op'] > before['alloc_blocks_per_op'] + .5
+        if slower or allocs:
+            found.append({'before': before, 'after': entry})
+    return found
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python3 -m easydb.bench')
+    parser.add_argument('--quick', action='store_true',
+                        help='fewer sizes and shorter runs')
+    parser.add_argument('--only', action='append',
+                        help='run benchmarks whose name contains this')
+    parser.add_argument('--output', help='write the JSON report to this file')
+    parser.add_argument('--baseline',
+                        help='JSON report to compare against, exits 1 on regressions')
+    parser.add_argument('--tolerance', type=float, default=.2,
+                        help='slowdown allowed against the baseline')
+    args = parser.parse_args(argv)
+
+    if args.quick:
+        report = run(rows=(1, 100), strlens=(16,), wide_columns=(50,),
+                     scan_counts=(1000,), target=10000, repeat=1, only=args.only)
+    else:
+        report = run(only=args.only)
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            report['regressions'] = regressions(report, json.load(f), args.tolerance)
+
+    text = json.dumps(report, indent=2)
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    if report.get('regressions'):
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,168 @@
+#!/usr/bin/python3
+#
+# cache.py
+#
+# Definition for the RowCache class, a client-side cache of rows in EasyDB
+#
+import threading
+import time
+from collections import OrderedDict
+
+class RowCache:
+
+    # maxsize: most rows kept, the least recently used row is evicted first
+    # ttl: seconds a row may be served from the cache, None for no limit
+    def __init__(self, maxsize=1024, ttl=None):
+        if maxsize < 1:
+            raise ValueError
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # (table_name, pk) -> (values, version, expiry time)
+        self._rows = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return "<EasyDB RowCache object>"
+
+    def __len__(self):
+        return len(self._rows)
+
+    # returns (values, version) of a cached row, or None
+    def get(self, table_name, pk):
+        key = (table_name, pk)
+        with self._lock:
+            entry = self._rows.get(key)
+            if entry is not None and entry[2] is not None and \
+                    entry[2] <= time.monotonic():
+                del self._rows[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._rows.move_to_end(key)
+            self.hits += 1
+        return list(entry[0]), entry[1]
+
+    # store a row as it is in the database at version
+    def put(self, table_name, pk, values, version):
+        key = (table_name, pk)
+        expiry = None if self.ttl is None else time.monotonic() + self.ttl
+        with self._lock:
+            entry = self._rows.get(key)
+            if entry is not None and entry[1] > version:
+                # a newer version has been cached already
+                return
+            self._rows[key] = (tuple(values), version, expiry)
+            self._rows.move_to_end(key)
+            while len(self._rows) > self.maxsize:
+                self._rows.popitem(last=False)
+                self.evictions += 1
+
+    def discard(self, table_name, pk):
+        with self._lock:
+            self._rows.pop((table_name, pk), None)
+
+    # forget every row of a table
+    def discard_table(self, table_name):
+        with self._lock:
+            for key in [key for key in self._rows if key[0] == table_name]:
+                del self._rows[key]
+
+    def clear(self):
+        with self._lock:
+            self._rows.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self._rows),
+                'maxsize': self.maxsize,
+            }
+
+class ScanCache:
+
+    # maxsize: most scan results kept, least recently used evicted first
+    # max_age: seconds a result may be served, bounds how stale it can be
+    #   after writes by other clients. None to rely on this client's writes.
+    def __init__(self, maxsize=256, max_age=1.):
+        if maxsize < 1:
+            raise ValueError
+        self.maxsize = maxsize
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        # table_name -> number of writes by this client to the table
+        self._generations = {}
+        # encoded query -> (table_name, generation, ids, time it was read)
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return "<EasyDB ScanCache object>"
+
+    def __len__(self):
+        return len(self._results)
+
+    # current write generation of a table, taken before a scan is sent
+    def generation(self, table_name):
+        return self._generations.get(table_name, 0)
+
+    # invalidate the cached scans of a table after a write to it
+    def bump(self, table_name):
+        with self._lock:
+            self._generations[table_name] = self._generations.get(table_name, 0) + 1
+
+    # returns the ids found by a cached query, or None
+    def get(self, table_name, query):
+        with self._lock:
+            entry = self._results.get(query)
+            if entry is not None:
+                stale = entry[1] != self._generations.get(table_name, 0) or \
+                    (self.max_age is not None and
+                     time.monotonic() - entry[3] > self.max_age)
+                if stale:
+                    del self._results[query]
+                    self.invalidations += 1
+                    entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._results.move_to_end(query)
+            self.hits += 1
+        return list(entry[2])
+
+    # store the ids found by query, sent when the table was at generation
+    def put(self, table_name, query, ids, generation):
+        with self._lock:
+            if generation != self._generations.get(table_name, 0):
+                # written to while the scan was in flight
+                return
+            self._results[query] = (table_name, generation, tuple(ids),
+                                    time.monotonic())
+            self._results.move_to_end(query)
+            while len(self._results) > self.maxsize:
+                self._results.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'size': len(self._results),
+                'maxsize': self.maxsize,
+            }
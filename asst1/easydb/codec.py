@@ -0,0 +1,133 @@
+#!/usr/bin/python3
+#
+# codec.py
+#
+# Definition for the RowCodec class, the compiled row format of a table
+#
+import struct
+from itertools import chain
+from .packet import *
+from .exception import *
+
+COUNT_STRUCT = struct.Struct('>i')
+HEADER_STRUCT = struct.Struct('>ii')        # column type, value size
+GET_STRUCT = struct.Struct('>iqi')          # code, version, value count
+INTEGER_STRUCT = struct.Struct('>q')
+FLOAT_STRUCT = struct.Struct('>d')
+PADDING = [b'', b'\x00', b'\x00\x00', b'\x00\x00\x00']
+
+# wire format of each fixed-width column type
+FIXED_FORMAT = {int: ('iiq', INTEGER), float: ('iid', FLOAT)}
+
+# values of fixed-width columns interleaved with their (type, size) headers
+def interleave(codes, sizes, values):
+    return chain.from_iterable(zip(codes, sizes, values))
+
+class RowCodec:
+
+    # columns: (column_name, column_type) pairs of the table, as in tablesInfo
+    # tables: names of the tables a column type may refer to
+    def __init__(self, columns, tables):
+        self.size = len(columns)
+        self.count = COUNT_STRUCT.pack(self.size)
+        # python type that each value must have, foreign keys are ints
+        self.types = []
+        self.codes = []
+        for name, colType in columns:
+            if colType in tables:
+                self.types.append(int)
+                self.codes.append(FOREIGN)
+            elif colType is str:
+                self.types.append(str)
+                self.codes.append(STRING)
+            else:
+                self.types.append(colType)
+                self.codes.append(FIXED_FORMAT[colType][1])
+
+        # split the row into runs of fixed-width columns, packed with one
+        # precomputed Struct each, and single string columns in between
+        self.segments = []  # (start, stop, Struct, codes), Struct None for str
+        start = 0
+        while start < self.size:
+            if self.types[start] is str:
+                self.segments.append((start, start + 1, None, None))
+                start += 1
+                continue
+            stop = start
+            fmt = '>'
+            while stop < self.size and self.types[stop] is not str:
+                fmt += FIXED_FORMAT[self.types[stop]][0]
+                stop += 1
+            self.segments.append((start, stop, struct.Struct(fmt),
+                                  tuple(self.codes[start:stop])))
+            start = stop
+
+        # tables without strings have a constant row size, the whole row
+        # (and the whole GET response) is then a single Struct
+        self.sizes = [8] * self.size
+        self.fixed = None
+        self.fixed_get = None
+        if STRING not in self.codes:
+            fmt = ''.join([FIXED_FORMAT[t][0] for t in self.types])
+            self.fixed = struct.Struct('>i' + fmt)
+            self.fixed_get = struct.Struct('>iqi' + fmt)
+            self.codes_get = tuple(self.codes)
+
+    def __repr__(self):
+        return "<EasyDB RowCodec object>"
+
+    # check the values against the schema and encode them as a row
+    def encode(self, values):
+        if len(values) != self.size or list(map(type, values)) != self.types:
+            raise PacketError
+        if self.fixed is not None:
+            return self.fixed.pack(self.size,
+                                   *interleave(self.codes, self.sizes, values))
+
+        parts = [self.count]
+        for start, stop, st, codes in self.segments:
+            if st is None:
+                data = values[start].encode('ascii')
+                pad = -len(data) % 4
+                parts.append(HEADER_STRUCT.pack(STRING, len(data) + pad))
+                parts.append(data)
+                parts.append(PADDING[pad])
+            else:
+                parts.append(st.pack(*interleave(codes, self.sizes,
+                                                 values[start:stop])))
+        return b''.join(parts)
+
+    # decode the values of an OK response to GET, returns (values, version),
+    # or None if the response does not have the layout of this table. The
+    # response is read in place through a memoryview, nothing is sliced off.
+    def decode(self, recv_response):
+        if self.fixed_get is not None:
+            if len(recv_response) != self.fixed_get.size:
+                return None
+            unpacked = self.fixed_get.unpack_from(recv_response)
+            if unpacked[3::3] != self.codes_get:
+                return None
+            return list(unpacked[5::3]), unpacked[1]
+
+        view = memoryview(recv_response)
+        code, version, count = GET_STRUCT.unpack_from(view)
+        if count != self.size:
+            return None
+        values = []
+        offset = GET_STRUCT.size
+        for start, stop, st, codes in self.segments:
+            if st is None:
+                c_type, c_size = HEADER_STRUCT.unpack_from(view, offset)
+                if c_type != STRING:
+                    return None
+                offset += HEADER_STRUCT.size
+                end = offset + c_size
+                values.append(str(view[offset:end], 'ascii').rstrip('\x00'))
+                offset = end
+            else:
+                unpacked = st.unpack_from(view, offset)
+                if unpacked[::3] != codes:
+                    return None
+                values.extend(unpacked[2::3])
+                offset += st.size
+        return values, version
@@ -0,0 +1,94 @@
+#!/usr/bin/python3
+#
+# connection.py
+#
+# Definition for the Connection class, a socket with a framed response reader
+#
+import struct
+import socket
+from .packet import *
+
+INT_STRUCT = struct.Struct('>i')
+
+# size of the fixed part of an OK response for each command (after the code)
+OK_SIZE = {INSERT: 16, UPDATE: 8, DROP: 0, GET: 12, SCAN: 4}
+
+class Connection:
+
+    def __init__(self, bufsize=4096):
+        self.sock = None
+        # one growable buffer reused for every response on this connection,
+        # data waiting to be consumed is self._buf[self._start:self._end]
+        self._buf = bytearray(bufsize)
+        self._start = 0
+        self._end = 0
+
+    def __repr__(self):
+        return "<EasyDB Connection object>"
+
+    def connect(self, host, port):
+        self.sock = socket.create_connection((host, int(port)))
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        code, = INT_STRUCT.unpack_from(self.read(4))
+        return code
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+        self._start = self._end = 0
+
+    def send(self, data):
+        self.sock.sendall(data)
+
+    # make sure at least size bytes are buffered, reading from the socket
+    def _fill(self, size):
+        while self._end - self._start < size:
+            buf = self._buf
+            pending = self._end - self._start
+            if len(buf) - self._start < size:
+                if len(buf) < size:
+                    # grow into a fresh buffer so earlier frames stay valid
+                    buf = bytearray(max(len(buf) * 2, size))
+                buf[:pending] = self._buf[self._start:self._end]
+                self._buf = buf
+                self._start = 0
+                self._end = pending
+            with memoryview(buf) as view:
+                n = self.sock.recv_into(view[self._end:])
+            if n == 0:
+                raise ConnectionError
+            self._end += n
+
+    # consume size bytes, the returned view is valid until the next read
+    def read(self, size):
+        self._fill(size)
+        start = self._start
+        self._start += size
+        if self._start == self._end:
+            self._start = self._end = 0
+        return memoryview(self._buf)[start:start + size]
+
+    # size of the complete response to command, reading only what is needed
+    def frame_size(self, command):
+        self._fill(4)
+        code, = INT_STRUCT.unpack_from(self._buf, self._start)
+        if code != OK or command is None:
+            return 4
+        size = 4 + OK_SIZE[command]
+        if command == SCAN:
+            self._fill(size)
+            count, = INT_STRUCT.unpack_from(self._buf, self._start + 4)
+            size += 8 * count
+        elif command == GET:
+            self._fill(size)
+            count, = INT_STRUCT.unpack_from(self._buf, self._start + 12)
+            for _ in range(count):
+                self._fill(size + 8)
+                c_size, = INT_STRUCT.unpack_from(self._buf, self._start + size + 4)
+                size += 8 + c_size
+        return size
+
+    # read one whole response to command from the stream
+    def read_response(self, command):
+        return self.read(self.frame_size(command))
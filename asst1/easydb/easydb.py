@@ -5,9 +5,18 @@
 # Definition for the Database class in EasyDB client
 #
 import struct
-import socket
+from collections import deque
 from .packet import *
 from .exception import *
+from .pool import ConnectionPool, RESPONSE_ERRORS
+from .connection import INT_STRUCT
+from .pipeline import Pipeline
+from .cache import RowCache, ScanCache
+from .codec import RowCodec, GET_STRUCT, HEADER_STRUCT, INTEGER_STRUCT, \
+    FLOAT_STRUCT
+from .stats import Metrics
+from functools import partial
+from time import perf_counter
 
 
 STRING = str
@@ -24,8 +33,6 @@ PACK_FORMAT = {'int': '>q','float': '>d',}
 COL_TYPE_CODE = {'int':INTEGER, 'str':STRING, 'float':FLOAT, 'foreign': FOREIGN}
 operator_dict = list(vars(operator).values())[1:8] 
 
-s = socket.socket() 
-
 class Database:
  
 
@@ -42,6 +49,11 @@ class Database:
 
         self.tablesInfo = {} # a dict for schema 
         self.tableIndexDict = {}
+        self.codecs = {} # a dict of compiled row formats
+        self.pool = None # connections borrowed by each call, set by connect
+        self.cache = None # rows read and written by this client, opt-in
+        self.scan_cache = None # ids found by recent scans, opt-in
+        self.metrics = Metrics() # per-command counters and latencies
         
         try: 
             iter(tables)
@@ -89,36 +101,128 @@ class Database:
             
             self.tablesInfo[tableName]= colInfo
             self.tableIndexDict[tableName] = index
+            self.codecs[tableName] = RowCodec(colInfo, self.tablesInfo)
 
         pass
     
 
-    def connect(self, host, port):
+    # minsize, maxsize, idle_timeout, check_interval: see ConnectionPool
+    def connect(self, host, port, **pool_options):
         try:
-            s.connect((host,int(port)))
-            con_response = s.recv(4096)
-            con_red_unpack = struct.unpack_from('>i',con_response)
-            recv_code = con_red_unpack[0]
-            if  recv_code == SERVER_BUSY:
-                self.close()
-                return False
+            self.pool = ConnectionPool(host, port, **pool_options)
             return True 
         except Exception as e:
-            self.close()
+            self.pool = None
             return False
 
 
     def close(self):
-        pack_exit = struct.pack('>ii',EXIT,1)
-        s.send(pack_exit)  
+        if self.pool is not None:
+            self.pool.close()
+            self.pool = None
         pass
+
+    # cache rows by (table_name, pk) for get, see RowCache. Rows this client
+    # inserts or updates are kept current and dropped rows are evicted.
+    def enable_cache(self, maxsize=1024, ttl=None):
+        self.cache = RowCache(maxsize, ttl)
+        return self.cache
+
+    def disable_cache(self):
+        self.cache = None
+
+    # cache the ids found by scan, see ScanCache. Writes by this client to a
+    # table invalidate its scans, max_age bounds staleness from other clients.
+    def enable_scan_cache(self, maxsize=256, max_age=1.):
+        self.scan_cache = ScanCache(maxsize, max_age)
+        return self.scan_cache
+
+    def disable_scan_cache(self):
+        self.scan_cache = None
+
+    # per-command calls, errors by response code, bytes sent and received,
+    # and encode/network/decode/total latency percentiles, plus slow commands
+    def stats(self):
+        result = self.metrics.summary()
+        if self.cache is not None:
+            result['cache'] = self.cache.stats()
+        if self.scan_cache is not None:
+            result['scan_cache'] = self.scan_cache.stats()
+        return result
+
+    # record commands taking at least threshold seconds in stats()['slow']
+    def enable_slow_log(self, threshold, maxlen=100):
+        self.metrics.slow_threshold = threshold
+        self.metrics.slow = deque(self.metrics.slow, maxlen=maxlen)
+
+    # queue requests and send them back-to-back on one connection, e.g.
+    #   with db.pipeline() as p:
+    #       user = p.get("User", 1)
+    #   user.result()
+    def pipeline(self, batch_size=MAX_PACKET_SIZE):
+        return Pipeline(self, batch_size)
+
+    # send a request packet on a borrowed connection and decode the complete
+    # response before the connection goes back to the pool
+    # started: perf_counter() before the packet was built, for encode time
+    def _request(self, command, packet, decode, table_name=None, started=None):
+        with self.pool.connection() as conn:
+            sent = perf_counter()
+            conn.send(packet)
+            recv_response = conn.read_response(command)
+            received = perf_counter()
+            try:
+                return decode(recv_response)
+            finally:
+                self._record(command, table_name, len(packet), recv_response,
+                             sent - (started or sent), received - sent,
+                             perf_counter() - received)
+
+    def _record(self, command, table_name, sent, recv_response, encode, network, decode):
+        code, = INT_STRUCT.unpack_from(recv_response)
+        self.metrics.record(command, table_name, code, sent, len(recv_response),
+                            encode, network, decode)
     
-    def check_row(self,table_name,values):
-        #value type = column type
-        for i,eachCol in enumerate(values):
-            if (type(eachCol) is not self.tablesInfo[table_name][i][1]) and (self.tablesInfo[table_name][i][1] not in self.tablesInfo.keys()):       
-                raise PacketError 
-        return
+    # send encoded requests back-to-back on one connection and yield their
+    # decoded responses in order. requests holds (command, end, decode,
+    # table_name) where end is the offset in buffer just past the request.
+    # Requests are written in batches of at most batch_size bytes, and errors
+    # reported by the server are yielded instead of raised. encoded is the
+    # time it took to build buffer, shared evenly by the requests in stats.
+    def _request_many(self, requests, buffer, batch_size=MAX_PACKET_SIZE, encoded=0.):
+        if len(requests) == 0:
+            return
+        encode = encoded / len(requests)
+        conn = self.pool.acquire()
+        in_sync = False
+        try:
+            with memoryview(buffer) as view:
+                start = 0
+                offset = 0
+                while start < len(requests):
+                    stop = start + 1
+                    while stop < len(requests) and \
+                            requests[stop][1] - offset <= batch_size:
+                        stop += 1
+                    end = requests[stop-1][1]
+                    sent = perf_counter()
+                    conn.send(view[offset:end])
+                    for command, request_end, decode, table_name in requests[start:stop]:
+                        recv_response = conn.read_response(command)
+                        received = perf_counter()
+                        try:
+                            result = decode(recv_response)
+                        except RESPONSE_ERRORS as e:
+                            result = e
+                        self._record(command, table_name, request_end - offset,
+                                     recv_response, encode, received - sent,
+                                     perf_counter() - received)
+                        offset = request_end
+                        yield result
+                    start = stop
+            in_sync = True
+        finally:
+            self.pool.release(conn, discard=not in_sync)
 
     def requestStruct(self, command,tableID):
         return struct.pack('>ii',command,tableID)
@@ -172,33 +276,19 @@ class Database:
         return inner_pack,value_pack
 
     def rowStruct(self, table_name,values):
-       
-        numEle = len(values)
-        pack_count = struct.pack('>i',numEle)
+        #checks the values as well, see RowCodec.encode
+        return self.codecs[table_name].encode(values)
+            
+    def insert(self, table_name, values):
+        started = perf_counter()
+        pack_com_row = self._insert_request(table_name, values)
+        return self._request(INSERT,pack_com_row,self._insert_decoder(table_name, values),
+                             table_name,started)
 
-        value_total=[None]*len(values)
-        for i,eachV in enumerate(values):         
-            inner_pack,value_pack = self.valueStruct(table_name,eachV,i)   
-            value_total[i] = b''.join([inner_pack,value_pack])     
-        temp = b''.join(value_total)
+    def _insert_request(self, table_name, values):
 
-        rowResult = b''.join([pack_count,temp])
-        return rowResult
-            
-    def check_input(self,table_name,values):
-        #check: 1. table name does not exist 2 . len(value) > column number 
         if table_name not in self.tablesInfo.keys():
             raise PacketError
-        elif len(values) != len(self.tablesInfo[table_name]):
-            raise PacketError   
-
-
-    def insert(self, table_name, values): 
-        
-
-
-        self.check_input(table_name, values)                   
-        self.check_row(table_name,values)
 
         tableID = self.tableIndexDict[table_name] +1  #id of the first table in the database is 1, rather than 0
         pack_command = self.requestStruct(INSERT,tableID)
@@ -207,9 +297,9 @@ class Database:
         pack_row= self.rowStruct(table_name,values)
         pack_com_row = b''.join([pack_command,pack_row])
 
-        s.send(pack_com_row)
+        return pack_com_row
 
-        recv_response = s.recv(4096)
+    def _insert_response(self, recv_response):
         if len(recv_response) == 4:
             error_code, = struct.unpack('>i',recv_response)
             self.errorCheck(error_code)
@@ -224,7 +314,48 @@ class Database:
                 self.errorCheck(recv_code)
                 return  
 
+    # insert every row in rows with pipelined requests. Returns a list with
+    # the (pk, version) of each row, None for the rows that failed, and a
+    # dict from row index to the error for that row.
+    def insert_many(self, table_name, rows, batch_size=MAX_PACKET_SIZE):
+        if table_name not in self.tablesInfo.keys():
+            raise PacketError
+        codec = self.codecs[table_name]
+        tableID = self.tableIndexDict[table_name] + 1
+        pack_command = self.requestStruct(INSERT,tableID)
+
+        started = perf_counter()
+        results = [None] * len(rows)
+        errors = {}
+        index = []
+        requests = []
+        buffer = bytearray()
+        for i, values in enumerate(rows):
+            try:
+                pack_row = codec.encode(values)
+            except PacketError as e:
+                errors[i] = e
+                continue
+            buffer += pack_command
+            buffer += pack_row
+            index.append(i)
+            requests.append((INSERT, len(buffer), self._insert_decoder(table_name, values), table_name))
+
+        responses = self._request_many(requests, buffer, batch_size, perf_counter() - started)
+        for result, i in zip(responses, index):
+            if isinstance(result, Exception):
+                errors[i] = result
+            else:
+                results[i] = result
+        return results, errors
+
     def update(self, table_name, pk, values, version=0):
+        started = perf_counter()
+        pack_com_key_row = self._update_request(table_name, pk, values, version)
+        return self._request(UPDATE,pack_com_key_row,self._update_decoder(table_name, pk, values),
+                             table_name,started)
+
+    def _update_request(self, table_name, pk, values, version=0):
         
         if version == None:
             version = 0
@@ -232,7 +363,8 @@ class Database:
         if type(pk) is not int or type(version) is not int:
             raise PacketError
 
-        self.check_input(table_name,values)
+        if table_name not in self.tablesInfo.keys():
+            raise PacketError
         
         tableID = self.tableIndexDict[table_name] + 1 
         pack_command = self.requestStruct(UPDATE,tableID)
@@ -241,13 +373,12 @@ class Database:
         pack_key = struct.pack('>qq',pk,version)
        
         #pack row
-        self.check_row(table_name,values)    
         pack_row= self.rowStruct(table_name,values)
         pack_com_key_row = b''.join([pack_command,pack_key,pack_row])
        
-        s.send(pack_com_key_row)
+        return pack_com_key_row
 
-        recv_response = s.recv(4096)
+    def _update_response(self, recv_response):
         if len(recv_response) == 4:
             error_code, = struct.unpack('>i',recv_response)
             self.errorCheck(error_code)
@@ -263,7 +394,53 @@ class Database:
 
         pass
 
+    # update every (pk, values, version) in rows with pipelined requests.
+    # Returns a list with the new version of each row, None for the rows that
+    # failed, and a dict from row index to the error for that row.
+    def update_many(self, table_name, rows, batch_size=MAX_PACKET_SIZE):
+        if table_name not in self.tablesInfo.keys():
+            raise PacketError
+        codec = self.codecs[table_name]
+        tableID = self.tableIndexDict[table_name] + 1
+        pack_command = self.requestStruct(UPDATE,tableID)
+
+        started = perf_counter()
+        results = [None] * len(rows)
+        errors = {}
+        index = []
+        requests = []
+        buffer = bytearray()
+        for i, (pk, values, version) in enumerate(rows):
+            if version == None:
+                version = 0
+            try:
+                if type(pk) is not int or type(version) is not int:
+                    raise PacketError
+                pack_row = codec.encode(values)
+            except PacketError as e:
+                errors[i] = e
+                continue
+            buffer += pack_command
+            buffer += struct.pack('>qq',pk,version)
+            buffer += pack_row
+            index.append(i)
+            requests.append((UPDATE, len(buffer), self._update_decoder(table_name, pk, values), table_name))
+
+        responses = self._request_many(requests, buffer, batch_size, perf_counter() - started)
+        for result, i in zip(responses, index):
+            if isinstance(result, Exception):
+                errors[i] = result
+            else:
+                results[i] = result
+        return results, errors
+
     def drop(self, table_name, pk):
+        started = perf_counter()
+        pack_com_id = self._drop_request(table_name, pk)
+        return self._request(DROP,pack_com_id,self._drop_decoder(table_name, pk),
+                             table_name,started)
+
+    def _drop_request(self, table_name, pk):
      
         if type(pk) is not int :
             raise PacketError
@@ -276,9 +453,9 @@ class Database:
         pack_id = struct.pack('>q',pk)
         pack_com_id = b''.join([pack_command,pack_id])
         
-        s.send(pack_com_id)
+        return pack_com_id
 
-        recv_response = s.recv(4096)
+    def _drop_response(self, recv_response):
         if len(recv_response) == 4:
             error_code, = struct.unpack('>i',recv_response)
             self.errorCheck(error_code)
@@ -286,6 +463,57 @@ class Database:
         pass
         
     def get(self, table_name, pk):
+        started = perf_counter()
+        pack_com_pk = self._get_request(table_name, pk)
+        if self.cache is not None:
+            cached = self.cache.get(table_name, pk)
+            if cached is not None:
+                return cached
+        return self._request(GET,pack_com_pk,self._get_decoder(table_name, pk),
+                             table_name,started)
+
+    # get the rows with the ids in pks with pipelined requests. Returns the
+    # (values, version) of each row in the order of pks. Missing rows raise
+    # ObjectDoesNotExist, or are None if skip_missing is True. Rows in the
+    # cache are not requested.
+    def get_many(self, table_name, pks, skip_missing=False, batch_size=MAX_PACKET_SIZE):
+        if table_name not in self.tablesInfo.keys():
+            raise PacketError
+        tableID = self.tableIndexDict[table_name] + 1
+        pack_command = self.requestStruct(GET,tableID)
+        decode = self._get_decoder(table_name)
+
+        started = perf_counter()
+        results = [None] * len(pks)
+        index = []
+        requests = []
+        buffer = bytearray()
+        for i, pk in enumerate(pks):
+            if type(pk) is not int:
+                raise PacketError
+            if self.cache is not None:
+                results[i] = self.cache.get(table_name, pk)
+                if results[i] is not None:
+                    continue
+                decode = self._get_decoder(table_name, pk)
+            buffer += pack_command
+            buffer += INTEGER_STRUCT.pack(pk)
+            index.append(i)
+            requests.append((GET, len(buffer), decode, table_name))
+
+        error = None
+        responses = self._request_many(requests, buffer, batch_size, perf_counter() - started)
+        for result, i in zip(responses, index):
+            if isinstance(result, Exception):
+                if not (skip_missing and isinstance(result, ObjectDoesNotExist)):
+                    error = error or result
+                result = None
+            results[i] = result
+        if error is not None:
+            raise error
+        return results
+
+    def _get_request(self, table_name, pk):
        
         if type(pk) is not int :
             raise PacketError
@@ -299,40 +527,137 @@ class Database:
 
         pack_com_pk = b''.join([pack_command,pack_id])
 
-        s.send(pack_com_pk)
+        return pack_com_pk
+
+    # decoder of GET responses for rows of table_name, which caches the row
+    # if the cache is on and pk is given
+    def _get_decoder(self, table_name, pk=None):
+        decode = partial(self._get_response, codec=self.codecs[table_name])
+        if self.cache is None or pk is None:
+            return decode
+        return partial(self._cache_get_response, self.cache, table_name, pk, decode)
+
+    # the following decoders keep the caches current with the responses to
+    # this client's own writes, a write to a table invalidates its scans
+
+    def _insert_decoder(self, table_name, values):
+        if self.cache is None and self.scan_cache is None:
+            return self._insert_response
+        return partial(self._cache_insert_response, table_name, tuple(values))
+
+    def _update_decoder(self, table_name, pk, values):
+        if self.cache is None and self.scan_cache is None:
+            return self._update_response
+        return partial(self._cache_update_response, table_name, pk, tuple(values))
+
+    def _drop_decoder(self, table_name, pk):
+        if self.cache is None and self.scan_cache is None:
+            return self._drop_response
+        return partial(self._cache_drop_response, table_name, pk)
+
+    # decoder of SCAN responses that caches the ids found by the query
+    def _scan_decoder(self, table_name, query):
+        if self.scan_cache is None:
+            return self._scan_response
+        return partial(self._cache_scan_response, self.scan_cache, table_name,
+                       query, self.scan_cache.generation(table_name))
+
+    def _cache_get_response(self, cache, table_name, pk, decode, recv_response):
+        try:
+            values, version = decode(recv_response)
+        except ObjectDoesNotExist:
+            cache.discard(table_name, pk)
+            raise
+        cache.put(table_name, pk, values, version)
+        return values, version
+
+    def _cache_insert_response(self, table_name, values, recv_response):
+        if self.scan_cache is not None:
+            self.scan_cache.bump(table_name)
+        result = self._insert_response(recv_response)
+        if result is not None and self.cache is not None:
+            self.cache.put(table_name, result[0], values, result[1])
+        return result
+
+    def _cache_update_response(self, table_name, pk, values, recv_response):
+        if self.scan_cache is not None:
+            self.scan_cache.bump(table_name)
+        try:
+            version = self._update_response(recv_response)
+        except (TransactionAbort, ObjectDoesNotExist):
+            # the cached version is out of date
+            if self.cache is not None:
+                self.cache.discard(table_name, pk)
+            raise
+        if version is not None and self.cache is not None:
+            self.cache.put(table_name, pk, values, version)
+        return version
+
+    # A drop cascades to the rows that refer to the dropped row, so the
+    # cached rows and scans of every table referring to it, even through
+    # another table, are dropped too.
+    def _cache_drop_response(self, table_name, pk, recv_response):
+        if self.scan_cache is not None:
+            self.scan_cache.bump(table_name)
+            for referrer in self._referrers(table_name):
+                self.scan_cache.bump(referrer)
+        if self.cache is not None:
+            self.cache.discard(table_name, pk)
+            for referrer in self._referrers(table_name):
+                self.cache.discard_table(referrer)
+        return self._drop_response(recv_response)
+
+    # names of the tables with foreign keys to table_name, directly or
+    # through other tables
+    def _referrers(self, table_name):
+        found = []
+        stack = [table_name]
+        while stack:
+            target = stack.pop()
+            for name, columns in self.tablesInfo.items():
+                if name not in found and \
+                        any(colType == target for colName, colType in columns):
+                    found.append(name)
+                    stack.append(name)
+        return found
+
+    def _cache_scan_response(self, cache, table_name, query, generation, recv_response):
+        result = self._scan_response(recv_response)
+        cache.put(table_name, query, result, generation)
+        return result
+
+    def _get_response(self, recv_response, codec=None):
+        if codec is not None and len(recv_response) > 4:
+            #rows in the layout of the table decode in one go
+            decoded = codec.decode(recv_response)
+            if decoded is not None:
+                return decoded
 
-        recv_response = s.recv(4096)
         if len(recv_response) == 4:
             error_code, = struct.unpack('>i',recv_response)
             self.errorCheck(error_code)
         else:
-            #decode values
-            info_list = struct.unpack_from('>iqi', recv_response, 0)
-            version = info_list[1]
-            cut_1 = struct.calcsize('>i')*2 + struct.calcsize('>q') #iqi
-            remain = recv_response[cut_1:]
-            count = info_list[2]
+            #decode values, walking the response with an offset
+            view = memoryview(recv_response)
+            code, version, count = GET_STRUCT.unpack_from(view, 0)
+            offset = GET_STRUCT.size
             result_list=[]
 
             while count >0:
-                cut_2 = struct.calcsize('>i')*2 
-                c_type,c_size,= struct.unpack_from('>ii', remain[:cut_2], 0)
-                fmt = '>ii'+'%ds'%c_size
-                temp = remain[:cut_2+c_size]
-                c_type, c_size,value = struct.unpack_from(fmt, temp, 0)
+                c_type,c_size,= HEADER_STRUCT.unpack_from(view, offset)
+                offset += HEADER_STRUCT.size
                
                 if c_type == STRING:
-                    value = value.rstrip(b'\x00')
-                    dec_val = value.decode('ascii')
+                    dec_val = str(view[offset:offset+c_size], 'ascii').rstrip('\x00')
                 elif c_type == FLOAT:
-                    dec_val, = struct.unpack_from('>d',value)
+                    dec_val, = FLOAT_STRUCT.unpack_from(view, offset)
                 elif c_type == INTEGER or c_type == FOREIGN:
-                    dec_val, = struct.unpack_from('>q',value)
+                    dec_val, = INTEGER_STRUCT.unpack_from(view, offset)
                 else:
-                    print('Shold not be here')
+                    dec_val = None
                 
                 result_list.append(dec_val)
-                remain = remain[cut_2+c_size:]
+                offset += c_size
                 count-=1
 
             value = result_list
@@ -342,6 +667,60 @@ class Database:
         pass
 
     def scan(self, table_name, op, column_name=None, value=None):
+        started = perf_counter()
+        pack_com_op = self._scan_request(table_name, op, column_name, value)
+        if self.scan_cache is not None:
+            cached = self.scan_cache.get(table_name, pack_com_op)
+            if cached is not None:
+                return cached
+        return self._request(SCAN,pack_com_op,self._scan_decoder(table_name, pack_com_op),
+                             table_name,started)
+
+    # iterate over the ids that match the query as they arrive on the socket,
+    # holding at most chunk of them in memory at a time. Stopping early
+    # closes the connection that was streaming them.
+    def scan_iter(self, table_name, op, column_name=None, value=None, chunk=1024):
+        if chunk < 1:
+            raise ValueError
+        started = perf_counter()
+        pack_com_op = self._scan_request(table_name, op, column_name, value)
+        return self._scan_ids(table_name, pack_com_op, chunk, perf_counter() - started)
+
+    def _scan_ids(self, table_name, pack_com_op, chunk, encode):
+        conn = self.pool.acquire()
+        in_sync = False
+        try:
+            sent = perf_counter()
+            conn.send(pack_com_op)
+            recv_code, = INT_STRUCT.unpack(conn.read(4))
+            received = 4
+            if recv_code != OK:
+                in_sync = True
+                self.metrics.record(SCAN, table_name, recv_code, len(pack_com_op),
+                                    received, encode, perf_counter() - sent, 0.)
+                self.errorCheck(recv_code)
+                return
+            count, = INT_STRUCT.unpack(conn.read(4))
+            received += 4 + 8 * count
+            decode = 0.
+            ids_struct = struct.Struct('>%dq' % min(chunk, count))
+            while count > 0:
+                if count < chunk:
+                    ids_struct = struct.Struct('>%dq' % count)
+                view = conn.read(ids_struct.size)
+                unpacked = perf_counter()
+                ids = ids_struct.unpack(view)
+                decode += perf_counter() - unpacked
+                count -= len(ids)
+                yield from ids
+            in_sync = True
+            # time spent by the consumer between chunks counts as network
+            self.metrics.record(SCAN, table_name, OK, len(pack_com_op), received,
+                                encode, perf_counter() - sent - decode, decode)
+        finally:
+            self.pool.release(conn, discard=not in_sync)
+
+    def _scan_request(self, table_name, op, column_name=None, value=None):
 
         try:
             temp = self.tablesInfo[table_name]
@@ -402,9 +781,9 @@ class Database:
 
         pack_com_op = b''.join([pack_command,pack_op,pack_value])
 
-        s.send(pack_com_op)
+        return pack_com_op
 
-        recv_response = s.recv(4096)
+    def _scan_response(self, recv_response):
         result = []
         if len(recv_response) == 4:
             error_code, = struct.unpack('>i',recv_response)
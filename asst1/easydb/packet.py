@@ -13,6 +13,9 @@ GET = 4
 SCAN = 5
 EXIT = 6
 
+# largest request the server reads in one go (ByteArray::MAX_PACKET_SIZE)
+MAX_PACKET_SIZE = 16384
+
 # response codes
 OK = 1
 NOT_FOUND = 2
@@ -0,0 +1,141 @@
+#!/usr/bin/python3
+#
+# pipeline.py
+#
+# Definition for the Pipeline class, requests sent back-to-back in EasyDB
+#
+from concurrent.futures import Future
+from time import perf_counter
+from .packet import *
+
+class Pipeline:
+
+    # db: connected Database whose request builders and decoders are used
+    # batch_size: bytes written before the responses to them are read back,
+    #   keeps both socket buffers from filling up with a long pipeline
+    def __init__(self, db, batch_size=MAX_PACKET_SIZE):
+        self.db = db
+        self.batch_size = batch_size
+        self._queue = [] # (command, packet, decode, table_name, future)
+        self._encoded = 0. # seconds spent building the queued packets
+        # tables with writes queued, reads from them skip the caches
+        self._written = set()
+
+    def __repr__(self):
+        return "<EasyDB Pipeline object>"
+
+    def __len__(self):
+        return len(self._queue)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.execute()
+        else:
+            self.reset()
+        return False
+
+    def _queue_request(self, command, packet, decode, table_name):
+        future = Future()
+        self._queue.append((command, packet, decode, table_name, future))
+        return future
+
+    # the following queue a request and return a Future for its result,
+    # arguments are validated right away as in the Database methods
+
+    def insert(self, table_name, values):
+        started = perf_counter()
+        packet = self.db._insert_request(table_name, values)
+        self._encoded += perf_counter() - started
+        self._written.add(table_name)
+        return self._queue_request(INSERT, packet,
+                                   self.db._insert_decoder(table_name, values),
+                                   table_name)
+
+    def update(self, table_name, pk, values, version=0):
+        started = perf_counter()
+        packet = self.db._update_request(table_name, pk, values, version)
+        self._encoded += perf_counter() - started
+        self._written.add(table_name)
+        return self._queue_request(UPDATE, packet,
+                                   self.db._update_decoder(table_name, pk, values),
+                                   table_name)
+
+    def drop(self, table_name, pk):
+        started = perf_counter()
+        packet = self.db._drop_request(table_name, pk)
+        self._encoded += perf_counter() - started
+        self._written.add(table_name)
+        return self._queue_request(DROP, packet,
+                                   self.db._drop_decoder(table_name, pk),
+                                   table_name)
+
+    def get(self, table_name, pk):
+        started = perf_counter()
+        packet = self.db._get_request(table_name, pk)
+        self._encoded += perf_counter() - started
+        if self.db.cache is not None and table_name not in self._written:
+            cached = self.db.cache.get(table_name, pk)
+            if cached is not None:
+                future = Future()
+                future.set_result(cached)
+                return future
+        return self._queue_request(GET, packet,
+                                   self.db._get_decoder(table_name, pk),
+                                   table_name)
+
+    def scan(self, table_name, op, column_name=None, value=None):
+        started = perf_counter()
+        packet = self.db._scan_request(table_name, op, column_name, value)
+        self._encoded += perf_counter() - started
+        if self.db.scan_cache is not None and table_name not in self._written:
+            cached = self.db.scan_cache.get(table_name, packet)
+            if cached is not None:
+                future = Future()
+                future.set_result(cached)
+                return future
+        return self._queue_request(SCAN, packet,
+                                   self.db._scan_decoder(table_name, packet),
+                                   table_name)
+
+    # drop all queued requests without sending them
+    def reset(self):
+        for command, packet, decode, table_name, future in self._queue:
+            future.cancel()
+        self._queue = []
+        self._encoded = 0.
+        self._written = set()
+
+    # send every queued request on one connection and read the responses in
+    # order, returns the futures in the order the requests were queued
+    def execute(self):
+        queue = self._queue
+        encoded = self._encoded
+        self._queue = []
+        self._encoded = 0.
+        self._written = set()
+
+        requests = []
+        end = 0
+        for command, packet, decode, table_name, future in queue:
+            end += len(packet)
+            requests.append((command, end, decode, table_name))
+        buffer = b''.join([item[1] for item in queue])
+
+        futures = [item[4] for item in queue]
+        try:
+            responses = self.db._request_many(requests, buffer, self.batch_size,
+                                              encoded)
+            for result, future in zip(responses, futures):
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+        except BaseException as e:
+            for future in futures:
+                if not future.done():
+                    future.set_exception(e)
+            raise
+        return futures
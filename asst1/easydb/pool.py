@@ -0,0 +1,196 @@
+#!/usr/bin/python3
+#
+# pool.py
+#
+# Definition for the ConnectionPool class, shared connections for EasyDB
+#
+import struct
+import threading
+import time
+from contextlib import contextmanager
+from .packet import *
+from .exception import *
+from .connection import Connection
+
+# errors decoded from a complete response, the stream is still in sync
+RESPONSE_ERRORS = (IntegrityError, InvalidReference, ObjectDoesNotExist,
+                   TransactionAbort, PacketError)
+
+# cheap request for health checks, GET of id 0 in the first table
+PING = struct.pack('>iiq', GET, 1, 0)
+
+class ConnectionPool:
+
+    # host, port: address of the EasyDB server
+    # minsize: connections opened up front and kept open while idle
+    # maxsize: most connections open at once, the server accepts only 4
+    # idle_timeout: seconds before an idle connection above minsize is closed
+    # check_interval: seconds a connection may sit idle before it is checked
+    def __init__(self, host, port, minsize=1, maxsize=4, idle_timeout=60.,
+                 check_interval=30.):
+        if minsize < 0 or maxsize < 1 or minsize > maxsize:
+            raise ValueError
+        self.host = host
+        self.port = port
+        self.minsize = minsize
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        self.check_interval = check_interval
+        self._idle = []     # (connection, time it was released), newest last
+        self._size = 0      # number of open connections, idle or borrowed
+        self._closed = False
+        self._cond = threading.Condition()
+
+        for _ in range(minsize):
+            conn = self._open()
+            if conn is None:
+                self.close()
+                raise ConnectionRefusedError
+            self._size += 1
+            self._idle.append((conn, time.monotonic()))
+
+    def __repr__(self):
+        return "<EasyDB ConnectionPool object>"
+
+    # returns a new connection, or None if the server is busy
+    def _open(self):
+        conn = Connection()
+        try:
+            if conn.connect(self.host, self.port) == OK:
+                return conn
+        except OSError:
+            pass
+        conn.close()
+        return None
+
+    def _discard(self, conn):
+        try:
+            conn.send(struct.pack('>ii', EXIT, 1))
+        except OSError:
+            pass
+        conn.close()
+
+    def _healthy(self, conn):
+        try:
+            conn.send(PING)
+            conn.read_response(GET)
+            return True
+        except OSError:
+            return False
+
+    # take out the connections above minsize that have been idle for too
+    # long, returns them to be discarded once the lock is released
+    def _expire(self, now):
+        expired = []
+        if self.idle_timeout is None:
+            return expired
+        while len(self._idle) > 0 and self._size > self.minsize:
+            conn, since = self._idle[0]
+            if now - since < self.idle_timeout:
+                break
+            del self._idle[0]
+            self._size -= 1
+            expired.append(conn)
+        return expired
+
+    # borrow a connection, waiting up to timeout seconds for one to free up.
+    # A slot is reserved or an idle connection taken under the lock, then
+    # the connection is opened or health checked without holding it, so
+    # other threads are not held up by the network.
+    def acquire(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        wait = False    # the server was busy, wait for a release first
+        while True:
+            conn = None
+            check = False
+            expired = []
+            try:
+                with self._cond:
+                    while True:
+                        if self._closed:
+                            raise ConnectionError
+                        now = time.monotonic()
+                        expired.extend(self._expire(now))
+                        if len(self._idle) > 0:
+                            conn, since = self._idle.pop()
+                            check = now - since >= self.check_interval
+                            break
+                        if self._size < self.maxsize and not wait:
+                            # reserve the slot while connecting
+                            self._size += 1
+                            break
+                        remaining = None if deadline is None else deadline - now
+                        if remaining is not None and remaining <= 0:
+                            raise TimeoutError
+                        self._cond.wait(remaining)
+                        wait = False
+            finally:
+                for old in expired:
+                    self._discard(old)
+
+            if conn is not None:
+                healthy = False
+                try:
+                    healthy = not check or self._healthy(conn)
+                finally:
+                    if not healthy:
+                        conn.close()
+                        self._give_up_slot()
+                if healthy:
+                    return conn
+                continue
+
+            try:
+                conn = self._open()
+            finally:
+                if conn is None:
+                    size = self._give_up_slot()
+            if conn is not None:
+                return conn
+            if size == 0:
+                raise ConnectionRefusedError
+            wait = True
+
+    # roll back the slot of a connection that was not handed out, returns
+    # the number of connections left
+    def _give_up_slot(self):
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+            return self._size
+
+    # give back a borrowed connection, discard it if its stream is unusable
+    def release(self, conn, discard=False):
+        with self._cond:
+            if discard or self._closed:
+                self._size -= 1
+            else:
+                self._idle.append((conn, time.monotonic()))
+                conn = None
+            self._cond.notify()
+        if conn is not None:
+            self._discard(conn)
+
+    @contextmanager
+    def connection(self, timeout=None):
+        conn = self.acquire(timeout)
+        try:
+            yield conn
+        except RESPONSE_ERRORS:
+            self.release(conn)
+            raise
+        except BaseException:
+            self.release(conn, discard=True)
+            raise
+        else:
+            self.release(conn)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            idle = self._idle
+            self._size -= len(idle)
+            self._idle = []
+            self._cond.notify_all()
+        for conn, since in idle:
+            self._discard(conn)
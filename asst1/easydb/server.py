@@ -0,0 +1,519 @@
+#!/usr/bin/python3
+#
+# server.py
+#
+# Definition for the Server class, a pure-Python EasyDB server for local
+# testing and benchmarking. It speaks the protocol of the server in asst3
+# and keeps the database in memory. Run it on a loopback port with
+#   python3 -m easydb.server [-g] PORT [FILE=default.txt] [HOST=localhost]
+# or in-process with
+#   with Server(tables) as server:
+#       db.connect(server.host, server.port)
+#
+import asyncio
+import re
+import struct
+import sys
+import threading
+from bisect import bisect_left, bisect_right, insort
+from .packet import *
+from .codec import (COUNT_STRUCT, HEADER_STRUCT, GET_STRUCT, INTEGER_STRUCT,
+                    FLOAT_STRUCT, PADDING)
+
+REQUEST_STRUCT = struct.Struct('>ii')       # command, table id
+ID_STRUCT = struct.Struct('>q')
+UPDATE_STRUCT = struct.Struct('>qq')        # id, version
+QUERY_STRUCT = struct.Struct('>ii')         # column id, operator
+INSERT_STRUCT = struct.Struct('>iqq')       # code, id, version
+UPDATE_OK_STRUCT = struct.Struct('>iq')     # code, version
+SCAN_STRUCT = struct.Struct('>ii')          # code, count
+
+OK_RESPONSE = COUNT_STRUCT.pack(OK)
+COLUMN_CODES = {int: INTEGER, float: FLOAT, str: STRING}
+SCHEMA_TYPES = {'integer': int, 'float': float, 'string': str}
+INFINITY = float('inf')
+
+# a request that the server answers with an error code
+class RequestError(Exception):
+    def __init__(self, code):
+        super().__init__(code)
+        self.code = code
+
+# a request that cannot be parsed, the server answers BAD_REQUEST and closes
+# the connection like the server in asst3
+class MalformedRequest(Exception):
+    pass
+
+# read a schema file in the format of asst3/default.txt into the tables
+# format that Database takes
+def load_schema(filename):
+    with open(filename) as f:
+        tokens = re.findall(r'[A-Za-z][A-Za-z0-9_]*|\S', f.read())
+    tables = []
+    names = set()
+    it = iter(tokens)
+    for name in it:
+        if next(it, None) != '{':
+            raise ValueError("expected { after table %s" % name)
+        columns = []
+        for column in it:
+            if column == '}':
+                break
+            if next(it, None) != ':':
+                raise ValueError("expected : after column %s" % column)
+            colType = next(it, None)
+            if colType in SCHEMA_TYPES:
+                colType = SCHEMA_TYPES[colType]
+            elif colType not in names:
+                raise ValueError("unknown type %s" % colType)
+            if next(it, None) != ';':
+                raise ValueError("expected ; after column %s" % column)
+            columns.append((column, colType))
+        else:
+            raise ValueError("unexpected end of file")
+        tables.append((name, tuple(columns)))
+        names.add(name)
+    if not tables:
+        raise ValueError("schema file is empty")
+    return tuple(tables)
+
+# encode the values of a row as in a GET response, None is NULL
+def encode_values(codes, values):
+    parts = []
+    for code, value in zip(codes, values):
+        if value is None:
+            parts.append(HEADER_STRUCT.pack(NULL, 0))
+        elif code == STRING:
+            data = value.encode('ascii')
+            pad = -len(data) % 4
+            parts.append(HEADER_STRUCT.pack(STRING, len(data) + pad))
+            parts.append(data)
+            parts.append(PADDING[pad])
+        elif code == FLOAT:
+            parts.append(HEADER_STRUCT.pack(FLOAT, 8))
+            parts.append(FLOAT_STRUCT.pack(value))
+        else:
+            parts.append(HEADER_STRUCT.pack(code, 8))
+            parts.append(INTEGER_STRUCT.pack(value))
+    return b''.join(parts)
+
+# decode count values of a request starting at offset, returns them as
+# (type, value) pairs and the offset past them
+def decode_values(payload, offset, count):
+    values = []
+    for _ in range(count):
+        c_type, c_size = HEADER_STRUCT.unpack_from(payload, offset)
+        offset += HEADER_STRUCT.size
+        end = offset + c_size
+        if c_size < 0 or end > len(payload):
+            raise MalformedRequest
+        if c_type == NULL:
+            if c_size != 0:
+                raise MalformedRequest
+            value = None
+        elif c_type == STRING:
+            try:
+                value = str(payload[offset:end], 'ascii').rstrip('\x00')
+            except UnicodeDecodeError:
+                raise MalformedRequest
+        elif c_type in (INTEGER, FOREIGN, FLOAT):
+            if c_size != 8:
+                raise MalformedRequest
+            if c_type == FLOAT:
+                value, = FLOAT_STRUCT.unpack_from(payload, offset)
+            else:
+                value, = INTEGER_STRUCT.unpack_from(payload, offset)
+        else:
+            raise MalformedRequest
+        values.append((c_type, value))
+        offset = end
+    return values, offset
+
+class Table:
+
+    def __init__(self, table_id, name, columns, table_ids):
+        self.id = table_id
+        self.name = name
+        self.columns = [column for column, colType in columns]
+        self.codes = []
+        self.refs = []      # table id a foreign key column refers to, or None
+        for column, colType in columns:
+            if colType in COLUMN_CODES:
+                self.codes.append(COLUMN_CODES[colType])
+                self.refs.append(None)
+            else:
+                self.codes.append(FOREIGN)
+                self.refs.append(table_ids[colType])
+        self.last_id = 0
+        # id -> [version, values, values encoded as in a GET response]
+        self.rows = {}
+        # per column, value -> ids of the rows with that value
+        self.hash_index = [{} for column in self.columns]
+        # per column, sorted (value, id) pairs for range scans, None for
+        # foreign keys which only support EQ and NE
+        self.sorted_index = [None if code == FOREIGN else []
+                             for code in self.codes]
+
+    def __repr__(self):
+        return "<EasyDB Table object>"
+
+    def index(self, row_id, values):
+        for i, value in enumerate(values):
+            if value is None:
+                continue
+            self.hash_index[i].setdefault(value, set()).add(row_id)
+            if self.sorted_index[i] is not None:
+                insort(self.sorted_index[i], (value, row_id))
+
+    def unindex(self, row_id, values):
+        for i, value in enumerate(values):
+            if value is None:
+                continue
+            ids = self.hash_index[i][value]
+            ids.discard(row_id)
+            if not ids:
+                del self.hash_index[i][value]
+            entries = self.sorted_index[i]
+            if entries is not None:
+                del entries[bisect_left(entries, (value, row_id))]
+
+class Store:
+
+    # tables: the schema in the format Database takes
+    def __init__(self, tables):
+        table_ids = {}
+        self.tables = []
+        for i, (name, columns) in enumerate(tables):
+            table_ids[name] = i + 1
+            self.tables.append(Table(i + 1, name, columns, table_ids))
+        # (table, column index) of the foreign keys that refer to each table
+        self.references = {table.id: [] for table in self.tables}
+        for table in self.tables:
+            for i, ref in enumerate(table.refs):
+                if ref is not None:
+                    self.references[ref].append((table, i))
+
+    def __repr__(self):
+        return "<EasyDB Store object>"
+
+    def table(self, table_id):
+        if table_id < 1 or table_id > len(self.tables):
+            raise RequestError(BAD_TABLE)
+        return self.tables[table_id - 1]
+
+    # check the (type, value) pairs of a row and return the values
+    def check_row(self, table, values):
+        if len(values) != len(table.codes):
+            raise RequestError(BAD_ROW)
+        row = []
+        for (c_type, value), code, ref in zip(values, table.codes, table.refs):
+            if c_type == FOREIGN:
+                if ref is None:
+                    raise RequestError(BAD_VALUE)
+                if value not in self.tables[ref - 1].rows:
+                    raise RequestError(BAD_FOREIGN)
+            elif c_type != NULL and c_type != code:
+                raise RequestError(BAD_VALUE)
+            row.append(value)
+        return row
+
+    def insert(self, table_id, values):
+        table = self.table(table_id)
+        values = self.check_row(table, values)
+        table.last_id += 1
+        row_id = table.last_id
+        table.rows[row_id] = [1, values, encode_values(table.codes, values)]
+        table.index(row_id, values)
+        return INSERT_STRUCT.pack(OK, row_id, 1)
+
+    def update(self, table_id, row_id, version, values):
+        table = self.table(table_id)
+        values = self.check_row(table, values)
+        row = table.rows.get(row_id)
+        if row is None:
+            raise RequestError(NOT_FOUND)
+        if version != 0 and version != row[0]:
+            raise RequestError(TXN_ABORT)
+        table.unindex(row_id, row[1])
+        row[0] += 1
+        row[1] = values
+        row[2] = encode_values(table.codes, values)
+        table.index(row_id, values)
+        return UPDATE_OK_STRUCT.pack(OK, row[0])
+
+    # drop a row and, like asst3, every row that refers to it
+    def drop(self, table_id, row_id):
+        table = self.table(table_id)
+        if row_id not in table.rows:
+            raise RequestError(NOT_FOUND)
+        self._drop(table, row_id)
+        return OK_RESPONSE
+
+    def _drop(self, table, row_id):
+        row = table.rows.pop(row_id, None)
+        if row is None:
+            # already dropped through a cycle of references
+            return
+        table.unindex(row_id, row[1])
+        for referring, i in self.references[table.id]:
+            for ref_id in list(referring.hash_index[i].get(row_id, ())):
+                self._drop(referring, ref_id)
+
+    def get(self, table_id, row_id):
+        table = self.table(table_id)
+        row = table.rows.get(row_id)
+        if row is None:
+            raise RequestError(NOT_FOUND)
+        return GET_STRUCT.pack(OK, row[0], len(row[1])) + row[2]
+
+    # ids of the rows whose column satisfies op against value, served from
+    # the hash index for EQ and NE and the sorted index for ranges
+    def scan(self, table_id, column_id, op, c_type, value):
+        table = self.table(table_id)
+        if column_id < 0 or column_id > len(table.codes) or \
+                op < operator.AL or op > operator.GE:
+            raise RequestError(BAD_QUERY)
+        if op == operator.AL:
+            if column_id != 0:
+                raise RequestError(BAD_QUERY)
+            ids = list(table.rows)
+        elif column_id == 0:
+            if c_type == NULL:
+                # asst3 returns every id for a NULL value
+                ids = list(table.rows)
+            elif c_type != INTEGER or (op != operator.EQ and op != operator.NE):
+                raise RequestError(BAD_QUERY)
+            elif op == operator.EQ:
+                ids = [value] if value in table.rows else []
+            else:
+                ids = [row_id for row_id in table.rows if row_id != value]
+        else:
+            ids = self._scan_column(table, column_id - 1, op, c_type, value)
+        return SCAN_STRUCT.pack(OK, len(ids)) + \
+            struct.pack('>%dq' % len(ids), *ids)
+
+    def _scan_column(self, table, i, op, c_type, value):
+        code = table.codes[i]
+        if c_type != code:
+            raise RequestError(BAD_QUERY)
+        # asst3 supports only EQ and NE on foreign keys and no EQ on floats
+        if code == FOREIGN and op != operator.EQ and op != operator.NE:
+            raise RequestError(BAD_QUERY)
+        if code == FLOAT and op == operator.EQ:
+            raise RequestError(BAD_QUERY)
+
+        if op == operator.EQ:
+            return sorted(table.hash_index[i].get(value, ()))
+        if op == operator.NE:
+            matched = table.hash_index[i].get(value, ())
+            return sorted([row_id for found in table.hash_index[i].values()
+                           if found is not matched for row_id in found])
+
+        entries = table.sorted_index[i]
+        if op == operator.LT:
+            entries = entries[:bisect_left(entries, (value,))]
+        elif op == operator.LE:
+            entries = entries[:bisect_right(entries, (value, INFINITY))]
+        elif op == operator.GT:
+            entries = entries[bisect_right(entries, (value, INFINITY)):]
+        else:
+            entries = entries[bisect_left(entries, (value,)):]
+        return sorted([row_id for _, row_id in entries])
+
+    # answer the request in payload, the bytes after command and table id
+    def handle(self, command, table_id, payload):
+        try:
+            if command == INSERT:
+                count, = COUNT_STRUCT.unpack_from(payload)
+                values, end = decode_values(payload, 4, count)
+                response = self.insert(table_id, values)
+            elif command == UPDATE:
+                row_id, version = UPDATE_STRUCT.unpack_from(payload)
+                count, = COUNT_STRUCT.unpack_from(payload, 16)
+                values, end = decode_values(payload, 20, count)
+                response = self.update(table_id, row_id, version, values)
+            elif command == DROP:
+                response = self.drop(table_id, ID_STRUCT.unpack(payload)[0])
+            elif command == GET:
+                response = self.get(table_id, ID_STRUCT.unpack(payload)[0])
+            elif command == SCAN:
+                column_id, op = QUERY_STRUCT.unpack_from(payload)
+                (c_type, value), = decode_values(payload, 8, 1)[0]
+                response = self.scan(table_id, column_id, op, c_type, value)
+            else:
+                raise MalformedRequest
+        except RequestError as e:
+            return COUNT_STRUCT.pack(e.code)
+        except struct.error:
+            raise MalformedRequest
+        return response
+
+# read the bytes of exactly one request, like read_request in asst3/packet.rs
+async def read_request(reader):
+    header = await reader.readexactly(REQUEST_STRUCT.size)
+    command, table_id = REQUEST_STRUCT.unpack(header)
+    parts = []
+    size = REQUEST_STRUCT.size
+
+    async def read(n):
+        nonlocal size
+        size += n
+        if n < 0 or size > MAX_PACKET_SIZE:
+            raise MalformedRequest
+        data = await reader.readexactly(n)
+        parts.append(data)
+        return data
+
+    async def read_value():
+        c_type, c_size = HEADER_STRUCT.unpack(await read(HEADER_STRUCT.size))
+        await read(c_size)
+
+    if command == INSERT or command == UPDATE:
+        if command == UPDATE:
+            await read(UPDATE_STRUCT.size)
+        count, = COUNT_STRUCT.unpack(await read(COUNT_STRUCT.size))
+        for _ in range(count):
+            await read_value()
+    elif command == DROP or command == GET:
+        await read(ID_STRUCT.size)
+    elif command == SCAN:
+        await read(QUERY_STRUCT.size)
+        await read_value()
+    return command, table_id, b''.join(parts)
+
+class Server:
+
+    # tables: the schema in the format Database takes, see load_schema
+    # max_clients: connections served at once, more are sent SERVER_BUSY
+    # verbose: print connects and disconnects
+    def __init__(self, tables, max_clients=4, verbose=False):
+        self.store = Store(tables)
+        self.max_clients = max_clients
+        self.verbose = verbose
+        self.host = None
+        self.port = None
+        self._clients = {}     # writer -> task serving the connection
+        self._server = None
+        self._loop = None
+        self._thread = None
+
+    def __repr__(self):
+        return "<EasyDB Server object>"
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        return False
+
+    # start listening from a running event loop, port 0 picks a free port
+    async def listen(self, host='127.0.0.1', port=0):
+        self._server = await asyncio.start_server(self._serve, host, port)
+        self.host, self.port = self._server.sockets[0].getsockname()[:2]
+        return self.port
+
+    async def serve_forever(self):
+        await self._server.serve_forever()
+
+    async def aclose(self):
+        self._server.close()
+        tasks = list(self._clients.values())
+        for writer in list(self._clients):
+            # the task serving it sees the end of the stream and returns
+            writer.close()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await self._server.wait_closed()
+
+    # serve from a thread of this process until stop, returns the port
+    def start(self, host='127.0.0.1', port=0):
+        started = threading.Event()
+        failed = []
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            try:
+                self._loop.run_until_complete(self.listen(host, port))
+            except BaseException as e:
+                failed.append(e)
+                return
+            finally:
+                started.set()
+            try:
+                self._loop.run_forever()
+            finally:
+                self._loop.close()
+
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+        started.wait()
+        if failed:
+            self._thread = None
+            raise failed[0]
+        return self.port
+
+    def stop(self):
+        if self._thread is not None:
+            asyncio.run_coroutine_threadsafe(self.aclose(), self._loop).result()
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._thread = None
+
+    async def _serve(self, reader, writer):
+        if len(self._clients) >= self.max_clients:
+            writer.write(COUNT_STRUCT.pack(SERVER_BUSY))
+            writer.close()
+            return
+        self._clients[writer] = asyncio.current_task()
+        if self.verbose:
+            print("Connected to", writer.get_extra_info('peername'))
+        try:
+            writer.write(OK_RESPONSE)
+            while True:
+                try:
+                    command, table_id, payload = await read_request(reader)
+                    if command == EXIT:
+                        break
+                    response = self.store.handle(command, table_id, payload)
+                except MalformedRequest:
+                    writer.write(COUNT_STRUCT.pack(BAD_REQUEST))
+                    break
+                writer.write(response)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._clients.pop(writer, None)
+            writer.close()
+            if self.verbose:
+                print("Disconnected.")
+
+def usage(prog):
+    print("usage: %s [-g] PORT [FILE=default.txt] [HOST=localhost]" % prog)
+    print("\t-g: debug mode (more verbose)")
+    print("\tFILE: EasyDB schema file")
+    print("\tHOST: host name")
+
+def main(argv):
+    verbose = len(argv) >= 2 and argv[1] == '-g'
+    args = argv[1:] if verbose else argv
+    if len(args) < 2 or len(args) > 4:
+        return usage('python3 -m easydb.server')
+    port = int(args[1])
+    filename = args[2] if len(args) >= 3 else 'default.txt'
+    host = args[3] if len(args) == 4 else 'localhost'
+    server = Server(load_schema(filename), verbose=verbose)
+
+    async def serve():
+        await server.listen(host, port)
+        print("Listening: %s:%d" % (server.host, server.port))
+        await server.serve_forever()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,129 @@
+#!/usr/bin/python3
+#
+# stats.py
+#
+# Definition for the Metrics class, per-command client statistics in EasyDB
+#
+import math
+import threading
+from collections import deque
+from .packet import *
+
+COMMAND_NAMES = {INSERT: 'INSERT', UPDATE: 'UPDATE', DROP: 'DROP', GET: 'GET',
+                 SCAN: 'SCAN'}
+RESPONSE_NAMES = {NOT_FOUND: 'NOT_FOUND', BAD_TABLE: 'BAD_TABLE',
+                  BAD_QUERY: 'BAD_QUERY', TXN_ABORT: 'TXN_ABORT',
+                  BAD_VALUE: 'BAD_VALUE', BAD_ROW: 'BAD_ROW',
+                  BAD_REQUEST: 'BAD_REQUEST', BAD_FOREIGN: 'BAD_FOREIGN',
+                  SERVER_BUSY: 'SERVER_BUSY', UNIMPLEMENTED: 'UNIMPLEMENTED'}
+PHASES = ('encode', 'network', 'decode', 'total')
+
+class Histogram:
+
+    # buckets grow by 2**(1/STEPS), about 9% apart, starting at 1 microsecond
+    STEPS = 8
+    UNIT = 1e-6
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.
+        self._buckets = {}
+
+    def add(self, seconds):
+        if seconds <= self.UNIT:
+            index = 0
+        else:
+            index = int(math.log2(seconds / self.UNIT) * self.STEPS) + 1
+        self._buckets[index] = self._buckets.get(index, 0) + 1
+        self.count += 1
+        self.total += seconds
+
+    # upper bound of the bucket that holds the p-th fraction of the samples
+    def percentile(self, p):
+        if self.count == 0:
+            return 0.
+        rank = p * self.count
+        seen = 0
+        for index in sorted(self._buckets):
+            seen += self._buckets[index]
+            if seen >= rank:
+                break
+        return self.UNIT * 2 ** (index / self.STEPS)
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else 0.,
+            'p50': self.percentile(.50),
+            'p95': self.percentile(.95),
+            'p99': self.percentile(.99),
+        }
+
+class CommandStats:
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = {}    # response code -> count
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.latency = {phase: Histogram() for phase in PHASES}
+
+    def summary(self):
+        return {
+            'calls': self.calls,
+            'errors': {RESPONSE_NAMES.get(code, code): n
+                       for code, n in self.errors.items()},
+            'bytes_sent': self.bytes_sent,
+            'bytes_received': self.bytes_received,
+            'latency': {phase: hist.summary()
+                        for phase, hist in self.latency.items()},
+        }
+
+class Metrics:
+
+    # slow_threshold: seconds a command may take before it is logged as slow,
+    #   None to not log
+    # slow_maxlen: most recent slow commands kept
+    def __init__(self, slow_threshold=None, slow_maxlen=100):
+        self.slow_threshold = slow_threshold
+        self.slow = deque(maxlen=slow_maxlen)
+        self._commands = {command: CommandStats() for command in COMMAND_NAMES}
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return "<EasyDB Metrics object>"
+
+    # account for one request, times are in seconds
+    def record(self, command, table_name, code, sent, received,
+               encode, network, decode):
+        total = encode + network + decode
+        with self._lock:
+            stats = self._commands[command]
+            stats.calls += 1
+            if code != OK:
+                stats.errors[code] = stats.errors.get(code, 0) + 1
+            stats.bytes_sent += sent
+            stats.bytes_received += received
+            stats.latency['encode'].add(encode)
+            stats.latency['network'].add(network)
+            stats.latency['decode'].add(decode)
+            stats.latency['total'].add(total)
+            if self.slow_threshold is not None and total >= self.slow_threshold:
+                self.slow.append({
+                    'table': table_name,
+                    'command': COMMAND_NAMES[command],
+                    'seconds': total,
+                    'result_size': received,
+                })
+
+    def reset(self):
+        with self._lock:
+            self._commands = {command: CommandStats() for command in COMMAND_NAMES}
+            self.slow.clear()
+
+    def summary(self):
+        with self._lock:
+            result = {COMMAND_NAMES[command]: stats.summary()
+                      for command, stats in self._commands.items()}
+            result['slow'] = list(self.slow)
+        return result
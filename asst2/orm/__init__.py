@@ -8,5 +8,8 @@
 from .easydb import IntegrityError, InvalidReference, ObjectDoesNotExist, \
     TransactionAbort, PacketError
 from .table import Table
+from .query import QuerySet
+from .session import Session
+from .aggregate import Sum, Min, Max, Avg
 from .field import Integer, Float, String, Foreign, DateTime, Coordinate
 from .orm import export, setup
@@ -0,0 +1,124 @@
+#!/usr/bin/python3
+#
+# aggregate.py
+#
+# Definitions for the aggregates of Table.aggregate
+#
+
+from datetime import datetime
+from .field import Integer, Float, Foreign, DateTime, Coordinate
+
+class Aggregate:
+    name = None
+    numeric = True      # not allowed on strings, Sum not on datetimes either
+
+    # field: str, name of the field to aggregate
+    def __init__(self, field):
+        self.field = field
+
+    def __repr__(self):
+        return "%s(%r)"%(self.__class__.__name__, self.field)
+
+    # key of the result in the dict returned by aggregate
+    def key(self):
+        return "%s__%s"%(self.field, self.name)
+
+    # the value folded so far, before any row
+    def initial(self):
+        return None
+
+    # fold one value that is not None into acc
+    def step(self, acc, value):
+        raise NotImplementedError
+
+    # the result from acc after count values, None if there were none
+    def finish(self, acc, count):
+        return acc
+
+class Sum(Aggregate):
+    name = 'sum'
+
+    def initial(self):
+        return 0
+
+    def step(self, acc, value):
+        return acc + value
+
+    def finish(self, acc, count):
+        return acc if count else None
+
+class Min(Aggregate):
+    name = 'min'
+    numeric = False
+
+    def step(self, acc, value):
+        return value if acc is None or value < acc else acc
+
+class Max(Aggregate):
+    name = 'max'
+    numeric = False
+
+    def step(self, acc, value):
+        return value if acc is None or value > acc else acc
+
+class Avg(Aggregate):
+    name = 'avg'
+
+    def initial(self):
+        return 0.
+
+    def step(self, acc, value):
+        return acc + value
+
+    def finish(self, acc, count):
+        return acc / count if count else None
+
+# Fold the raw values of rows into the aggregates of model, row by row.
+# Returns the results keyed by Aggregate.key.
+class Folder:
+
+    def __init__(self, model, aggregates):
+        self.aggregates = aggregates
+        self.indexes = []   # index of the value of each aggregate in a row
+        self.dates = []     # whether each aggregate is over a DateTime
+        for aggregate in aggregates:
+            index = 0
+            for f_name, obj in model._fields:
+                if f_name == aggregate.field:
+                    break
+                index += 2 if type(obj) is Coordinate else 1
+            else:
+                raise AttributeError
+            if isinstance(obj, (Foreign, Coordinate)):
+                raise TypeError
+            if type(obj) is DateTime and type(aggregate) is Sum:
+                raise TypeError
+            if aggregate.numeric and type(obj) not in (Integer, Float, DateTime):
+                raise TypeError
+            self.indexes.append(index)
+            self.dates.append(type(obj) is DateTime)
+        self.accs = [aggregate.initial() for aggregate in aggregates]
+        self.counts = [0] * len(aggregates)
+
+    def __repr__(self):
+        return "<ORM Folder object>"
+
+    def add(self, values):
+        for i, aggregate in enumerate(self.aggregates):
+            value = values[self.indexes[i]]
+            if value is None:
+                continue
+            if aggregate.numeric and not self.dates[i] and \
+                    type(value) not in (int, float):
+                raise TypeError
+            self.accs[i] = aggregate.step(self.accs[i], value)
+            self.counts[i] += 1
+
+    def results(self):
+        result = {}
+        for i, aggregate in enumerate(self.aggregates):
+            value = aggregate.finish(self.accs[i], self.counts[i])
+            if self.dates[i] and value is not None:
+                value = datetime.fromtimestamp(value) #float -> datetime
+            result[aggregate.key()] = value
+        return result
@@ -0,0 +1,279 @@
+#!/usr/bin/python3
+#
+# bench.py
+#
+# Offline micro-benchmarks for the ORM, run from asst2 with
+#   python3 -m orm.bench [--quick] [--output FILE] [--baseline FILE]
+#
+# Measures building objects, flattening them into rows and building them
+# from decoded rows without a server, and prints the objects per second as JSON.
+#
+import argparse
+import json
+import platform
+import sys
+import time
+from datetime import datetime
+from .easydb.bench import ops_per_sec, allocations, regressions
+from .table import Table, MetaTable
+from .reference import Reference
+from .field import Integer, Float, String, Foreign, DateTime, Coordinate
+
+WIDE_COLUMNS = 20
+
+def wide_fields(columns):
+    fields = {}
+    for i in range(columns // 2):
+        fields['s%d' % i] = String()
+    for i in range(columns // 2):
+        fields['f%d' % i] = Float()
+    return fields
+
+_tables = None
+
+# The tables of asst2/schema.py and a wide one, by name. Every table class
+# is registered with MetaTable and exported with the schema, so they are
+# only defined when a benchmark runs, with names that do not clash with
+# schema.py.
+def bench_tables():
+    global _tables
+    if _tables is not None:
+        return _tables
+
+    class BenchUser(Table):
+        firstName = String()
+        lastName = String()
+        height = Float(blank=True)
+        age = Integer(blank=True)
+
+    class BenchAccount(Table):
+        user = Foreign(BenchUser)
+        type = String(choices=["Savings", "Chequing",], default="Chequing")
+        balance = Float(blank=True)
+
+    class BenchCapital(Table):
+        location = Coordinate()
+        name = String()
+
+    class BenchParade(Table):
+        location = Foreign(BenchCapital)
+        start = DateTime(default=datetime.now)
+        end = DateTime(blank=True)
+
+    BenchWide = type(Table)('BenchWide', (Table,), wide_fields(WIDE_COLUMNS))
+
+    _tables = {
+        'User': BenchUser,
+        'Account': BenchAccount,
+        'Capital': BenchCapital,
+        'Parade': BenchParade,
+        'Wide': BenchWide,
+    }
+    return _tables
+
+OBJECTS = (1, 100, 1000)        # objects built or flattened per operation
+TARGET = 100000                 # objects handled per timing run
+
+# Table.__init__ and _get_field_values(format=True) before MetaTable
+# generated them, they loop over the fields and are kept here to measure
+# against
+
+def legacy_init(self, db, **kwargs):
+    self.pk = None
+    self.version = None
+    self._db = db
+    self._session = None
+    for name, obj in self.__class__._fields:
+        should_be_specified = not obj.blank and obj.default is None
+        if name in kwargs:
+            setattr(self, name, kwargs[name])
+        else:
+            setattr(self, name, None)
+            if should_be_specified:
+                raise AttributeError
+
+def legacy_row(self):
+    values = []
+    for name in self._field_names:
+        value = getattr(self, name)
+        if isinstance(value, (Table, Reference)):
+            values.append(value.pk)
+        else:
+            if type(value) is tuple: #coordinate
+                values.append(value[0])
+                values.append(value[1])
+            else:
+                if type(value) is datetime:
+                    value = value.timestamp()
+                values.append(value)
+    return values
+
+# MetaTable._from_row before the hydrator, it builds the keyword arguments
+# and checks them again in the constructor
+def legacy_from_row(cls, db, pk, values, version, foreign, session=None):
+    kwargs = {}
+    index = 0
+    for f_name, obj in cls._fields:
+        if isinstance(obj,Foreign):
+            if index in foreign:
+                kwargs[f_name] = foreign[index][values[index]]
+            else:
+                kwargs[f_name] = MetaTable._reference(obj.table, db, values[index], session)
+            index+=1
+        elif type(obj) is Coordinate:
+            kwargs[f_name] = (values[index], values[index+1]) #2-tuple -> 2 values
+            index+=2
+        elif type(obj) is DateTime:
+            kwargs[f_name] = datetime.fromtimestamp(values[index]) #float -> datetime
+            index +=1
+        else:
+            kwargs[f_name] = values[index]
+            index+=1
+    result = cls(db, **kwargs)
+    result.pk = pk
+    result.version = version
+    return result
+
+# the keyword arguments of seed objects of each table
+def sample_kwargs(tables, count):
+    user = tables['User'](None, firstName="James", lastName="Bond")
+    user.pk = 1
+    capital = tables['Capital'](None, location=(43.65, -79.38), name="Toronto")
+    capital.pk = 1
+    wide = {}
+    for i in range(WIDE_COLUMNS // 2):
+        wide['s%d' % i] = 'v%d' % i
+        wide['f%d' % i] = i + .5
+    return {
+        'User': [dict(firstName="James", lastName="Bond%d" % seed,
+                      height=180. + seed % 10, age=seed % 90)
+                 for seed in range(count)],
+        'Account': [dict(user=user, type="Savings", balance=seed + .5)
+                    for seed in range(count)],
+        'Capital': [dict(location=(seed % 90, -(seed % 180)), name="City%d" % seed)
+                    for seed in range(count)],
+        'Parade': [dict(location=capital, start=datetime.fromtimestamp(seed * 60),
+                        end=datetime.fromtimestamp(seed * 60 + 3600))
+                   for seed in range(count)],
+        'Wide': [wide] * count,
+    }
+
+# the benchmarks of a table with a list of keyword arguments, as
+# (name, func) where func returns the objects or rows it built
+def table_cases(model, kwargs_list):
+    objects = [model(None, **kwargs) for kwargs in kwargs_list]
+    assert [obj._row() for obj in objects] == [legacy_row(obj) for obj in objects]
+
+    def construct():
+        return [model(None, **kwargs) for kwargs in kwargs_list]
+
+    def construct_legacy():
+        result = []
+        for kwargs in kwargs_list:
+            obj = model.__new__(model)
+            legacy_init(obj, None, **kwargs)
+            result.append(obj)
+        return result
+
+    def row():
+        return [obj._row() for obj in objects]
+
+    def row_legacy():
+        return [legacy_row(obj) for obj in objects]
+
+    rows = [(pk, obj._row()) for pk, obj in enumerate(objects, 1)]
+
+    def hydrate():
+        return [model._from_row(None, pk, values, 1, {}) for pk, values in rows]
+
+    # hydrate and read every field, converting each DateTime and Coordinate
+    def hydrate_read():
+        result = [model._from_row(None, pk, values, 1, {}) for pk, values in rows]
+        for obj in result:
+            for name in model._field_names:
+                getattr(obj, name)
+        return result
+
+    def hydrate_legacy():
+        return [legacy_from_row(model, None, pk, values, 1, {}) for pk, values in rows]
+
+    yield 'construct', construct
+    yield 'construct.legacy', construct_legacy
+    yield 'row', row
+    yield 'row.legacy', row_legacy
+    yield 'hydrate', hydrate
+    yield 'hydrate.read', hydrate_read
+    yield 'hydrate.legacy', hydrate_legacy
+
+# time func, which handles size objects per call, and measure its
+# allocations. ops are objects per second, allocations are per object.
+def measure(func, size, target=TARGET, repeat=3):
+    number = max(1, target // size)
+    blocks, peak = allocations(func)
+    return {
+        'ops_per_sec': ops_per_sec(func, number, repeat) * size,
+        'alloc_blocks_per_op': blocks / size,
+        'alloc_bytes_per_op': peak / size,
+    }
+
+def run(objects=OBJECTS, target=TARGET, repeat=3, only=None):
+    results = []
+    tables = bench_tables()
+    for size in objects:
+        samples = sample_kwargs(tables, size)
+        for table, model in tables.items():
+            params = {
+                'table': table,
+                'columns': len(model._fields),
+                'objects': size,
+            }
+            for name, func in table_cases(model, samples[table]):
+                if only is not None and not any(pattern in name for pattern in only):
+                    continue
+                entry = {'name': name}
+                entry.update(params)
+                entry.update(measure(func, size, target, repeat))
+                results.append(entry)
+
+    return {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'machine': platform.machine(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'results': results,
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python3 -m orm.bench')
+    parser.add_argument('--quick', action='store_true',
+                        help='fewer sizes and shorter runs')
+    parser.add_argument('--only', action='append',
+                        help='run benchmarks whose name contains this')
+    parser.add_argument('--output', help='write the JSON report to this file')
+    parser.add_argument('--baseline',
+                        help='JSON report to compare against, exits 1 on regressions')
+    parser.add_argument('--tolerance', type=float, default=.2,
+                        help='slowdown allowed against the baseline')
+    args = parser.parse_args(argv)
+
+    if args.quick:
+        report = run(objects=(100,), target=10000, repeat=1, only=args.only)
+    else:
+        report = run(only=args.only)
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            report['regressions'] = regressions(report, json.load(f), args.tolerance)
+
+    text = json.dumps(report, indent=2)
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    if report.get('regressions'):
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,145 @@
+#!/usr/bin/python3
+#
+# codegen.py
+#
+# Generates the constructor, the row flattener and the hydrator of each
+# table class, so building, saving and loading an object runs straight-line
+# code instead of looping over the fields
+#
+
+from .field import Foreign, DateTime, Coordinate
+
+# Compile the source lines of a function called name, with the globals in
+# namespace, and return the function.
+def compile_function(name, lines, namespace):
+    source = '\n'.join(lines) + '\n'
+    exec(compile(source, '<orm %s>' % name, 'exec'), namespace)
+    return namespace[name]
+
+# Returns the __init__ of a table class with fields, as (name, Field) in
+# order. Each field is a keyword argument, validated by its Field and
+# stored in its slot, e.g. for User:
+#   def __init__(_self, _db, *, firstName=None, ..., **_kwargs):
+#       _self.pk = None
+#       _self.version = None
+#       _self._db = _db
+#       _self._session = None
+#       _store_firstName(_self, _validate_firstName(firstName))
+#       ...
+# Field names have no underscore, so they cannot clash with the others.
+def make_init(fields):
+    namespace = {}
+    params = ''.join(['%s=None, ' % name for name, obj in fields])
+    if params:
+        # the fields can only be given by keyword
+        params = '*, ' + params
+    lines = [
+        'def __init__(_self, _db, %s**_kwargs):' % params,
+        '    _self.pk = None',
+        '    _self.version = None',
+        '    _self._db = _db',
+        '    _self._session = None',
+    ]
+    for name, obj in fields:
+        if type(obj) is Coordinate:
+            # also the latitude and longitude slots
+            namespace['_store_' + name] = obj._store
+        else:
+            namespace['_store_' + name] = obj._slot.__set__
+        namespace['_validate_' + name] = obj._validate
+        lines.append('    _store_%s(_self, _validate_%s(%s))' % (name, name, name))
+    return compile_function('__init__', lines, namespace)
+
+# Returns the function that flattens an object into the values of its row
+# as sent to the database: a Coordinate becomes latitude and longitude, a
+# DateTime its timestamp and a Foreign the primary key of its object. A
+# loaded object that was not changed still has the values of its row in
+# its slots. The locals are prefixed so a field called e.g. type or float
+# does not hide the builtin, e.g. for Parade:
+#   def _row(_self):
+#       _v_location = _self._location
+#       _v_start = _self._start
+#       _v_end = _self._end
+#       return [_v_location.pk,
+#               _v_start if type(_v_start) is float else _v_start.timestamp(),
+#               _v_end if type(_v_end) is float else _v_end.timestamp()]
+def make_row(fields):
+    lines = ['def _row(_self):']
+    values = []
+    for name, obj in fields:
+        if type(obj) is Coordinate:
+            values.append('_self._%s_lat' % name)
+            values.append('_self._%s_long' % name)
+            continue
+        local = '_v_' + name
+        lines.append('    %s = _self._%s' % (local, name))
+        if isinstance(obj, Foreign):
+            if obj.blank:
+                values.append('None if %s is None else %s.pk' % (local, local))
+            else:
+                values.append('%s.pk' % local)
+        elif type(obj) is DateTime:
+            values.append('%s if type(%s) is float else %s.timestamp()'
+                          % (local, local, local))
+        else:
+            values.append(local)
+    lines.append('    return [%s]' % ', '.join(values))
+    return compile_function('_row', lines, {})
+
+# Returns the function that builds an object of model from the values of
+# its row as decoded from the database, without the checks, choices and
+# defaults of the constructor since the server has stored the row already.
+# reference(table, db, pk, session) gives the object of a foreign key that
+# was not fetched. A DateTime keeps its timestamp and a Coordinate its
+# latitude and longitude, they are converted when first read. e.g. for
+# Parade:
+#   def _hydrate(_db, _pk, _version, _values, _foreign, _session):
+#       location, start, end = _values
+#       _self = _new(_model)
+#       _self.pk = _pk
+#       _self.version = _version
+#       _self._db = _db
+#       _self._session = _session
+#       _refs = _foreign.get(0)
+#       _self._location = _reference(_table_location, _db, location, _session) \
+#           if _refs is None else _refs[location]
+#       _self._start = start
+#       _self._end = end
+#       return _self
+def make_hydrate(model, fields, reference):
+    namespace = {
+        '_new': object.__new__,
+        '_model': model,
+        '_reference': reference,
+    }
+    columns = []
+    lines = []
+    for name, obj in fields:
+        index = len(columns)
+        if isinstance(obj, Foreign):
+            namespace['_table_' + name] = obj.table
+            columns.append(name)
+            lines.append('    _refs = _foreign.get(%d)' % index)
+            lines.append('    _self._%s = _reference(_table_%s, _db, %s, _session) \\'
+                         % (name, name, name))
+            lines.append('        if _refs is None else _refs[%s]' % name)
+        elif type(obj) is Coordinate:
+            # names with an underscore cannot clash with a field
+            columns.append(name + '_lat')
+            columns.append(name + '_long')
+            lines.append('    _self._%s_lat = %s_lat' % (name, name))
+            lines.append('    _self._%s_long = %s_long' % (name, name))
+        else:
+            columns.append(name)
+            lines.append('    _self._%s = %s' % (name, name))
+    header = ['def _hydrate(_db, _pk, _version, _values, _foreign, _session):']
+    if columns:
+        header.append('    %s, = _values' % ', '.join(columns))
+    lines = header + [
+        '    _self = _new(_model)',
+        '    _self.pk = _pk',
+        '    _self.version = _version',
+        '    _self._db = _db',
+        '    _self._session = _session',
+    ] + lines + ['    return _self']
+    return compile_function('_hydrate', lines, namespace)
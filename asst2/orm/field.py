@@ -6,6 +6,7 @@
 #
 
 from datetime import datetime
+from .reference import Reference
 
 class Field:
     def __init__(self, blank=False, default=None, choices=None):
@@ -22,15 +23,37 @@ class Field:
         self.blank = blank
         self.default = default
         self.choices = choices
-        self._values = {}
+        self._slot = None   # slot of the table class holding the value, set by MetaTable
     
     def __get__(self, inst, owner):
-        return self._values[inst]
+        if inst is None:
+            return self
+        return self._slot.__get__(inst, owner)
 
     def __set__(self, inst, value):
-        if inst in self._values and value is None:
+        if value is None and self._is_set(inst):
             raise AttributeError
-        elif value is None:
+        self._store(inst, self._validate(value))
+        # changed objects of a session are written by its flush
+        session = inst._session
+        if session is not None:
+            session._modified(inst)
+
+    # names of the slots that hold the value of the field called name
+    def _slot_names(self, name):
+        return ('_' + name,)
+
+    # take the slots of the field called name once cls has them
+    def _bind(self, cls, name):
+        self._slot = cls.__dict__['_' + name]
+
+    def _store(self, inst, value):
+        self._slot.__set__(inst, value)
+
+    # the value to store for a value given by the application, the default
+    # if it is None
+    def _validate(self, value):
+        if value is None:
             if not self.blank and self.default is None:
                 raise AttributeError
             value = self.default   
@@ -41,7 +64,14 @@ class Field:
         if self.choices is not None:
             if self.choices and value not in self.choices:
                 raise ValueError
-        self._values[inst] = value
+        return value
+
+    def _is_set(self, inst):
+        try:
+            self._slot.__get__(inst, None)
+        except AttributeError:
+            return False
+        return True
     
     @classmethod
     def check_type(cls, value):
@@ -86,7 +116,9 @@ class Foreign(Field):
         self.table = table
 
     def check_type(self, value):
-        if type(value) is not self.table:
+        if isinstance(value, Reference) and value._model is self.table:
+            pass
+        elif type(value) is not self.table:
             if value is None and self.blank:
                 pass
             else:
@@ -106,6 +138,17 @@ class DateTime(Field):
         
         super().__init__(blank,default,choices)
     
+    # A loaded object holds the timestamp of the row until the field is
+    # first read.
+    def __get__(self, inst, owner):
+        if inst is None:
+            return self
+        value = self._slot.__get__(inst, owner)
+        if type(value) is float:
+            value = datetime.fromtimestamp(value) #float -> datetime
+            self._slot.__set__(inst, value)
+        return value
+
     @classmethod
     def check_type(cls, value):
         if type(value) is not datetime:
@@ -116,6 +159,42 @@ class Coordinate(Field):
 
     def __init__(self, blank=False, default=None, choices=None):
         super().__init__(blank,default,choices)
+        self._lat = None    # slots of the latitude and longitude
+        self._long = None
+
+    # The latitude and longitude are kept in slots of their own, as sent to
+    # the database. The tuple is built on the first read of a loaded object.
+    def __get__(self, inst, owner):
+        if inst is None:
+            return self
+        try:
+            return self._slot.__get__(inst, owner)
+        except AttributeError:
+            value = (self._lat.__get__(inst, owner), self._long.__get__(inst, owner))
+            self._slot.__set__(inst, value)
+            return value
+
+    def _slot_names(self, name):
+        return ('_' + name, '_%s_lat' % name, '_%s_long' % name)
+
+    def _bind(self, cls, name):
+        self._slot = cls.__dict__['_' + name]
+        self._lat = cls.__dict__['_%s_lat' % name]
+        self._long = cls.__dict__['_%s_long' % name]
+
+    def _store(self, inst, value):
+        self._slot.__set__(inst, value)
+        if value is None:
+            value = (None, None)
+        self._lat.__set__(inst, value[0])
+        self._long.__set__(inst, value[1])
+
+    def _is_set(self, inst):
+        try:
+            self._lat.__get__(inst, None)
+        except AttributeError:
+            return False
+        return True
     
     @classmethod
     def check_type(cls, value):
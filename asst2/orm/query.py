@@ -0,0 +1,213 @@
+#!/usr/bin/python3
+#
+# query.py
+#
+# Definition for QuerySet, the lazy result of Table.filter
+#
+
+from .easydb import operator, ObjectDoesNotExist
+from .field import Foreign
+from .reference import Reference
+from .aggregate import Folder
+
+# rows read per get_many by aggregate
+AGGREGATE_BATCH = 1024
+
+class QuerySet:
+
+    # model: table class the objects are from
+    # db: database object, the database to get the objects from
+    # session: Session whose objects are shared, or None
+    def __init__(self, model, db, session=None):
+        self.model = model
+        self._db = db
+        self._session = session
+        self._eager = False     # fetch the objects foreign keys refer to
+        self._prefetch = []     # paths of foreign keys to fetch in batches
+        self._predicates = []   # (column name, operator, value), all must hold
+        self._excludes = []     # lists of predicates, rows matching one are left out
+        self._pk_cache = None   # primary keys of the matching rows, sorted
+        self._result_cache = None
+
+    def __repr__(self):
+        return "<ORM QuerySet object>"
+
+    def _clone(self):
+        clone = QuerySet(self.model, self._db, self._session)
+        clone._predicates = list(self._predicates)
+        clone._excludes = list(self._excludes)
+        clone._eager = self._eager
+        clone._prefetch = list(self._prefetch)
+        return clone
+
+    # check predicates against the schema now rather than when evaluated
+    def _check(self, predicates):
+        for columnname, op, value in predicates:
+            self._db._scan_request(self.model.__name__, op, columnname, value)
+
+    # Returns a new QuerySet with rows that also match the query.
+    def filter(self, **kwarg):
+        predicates = self.model._predicates(kwarg)
+        self._check(predicates)
+        clone = self._clone()
+        clone._predicates.extend(predicates)
+        return clone
+
+    # Returns a new QuerySet that fetches the objects foreign keys refer to
+    # along with its rows, instead of on first access.
+    def eager(self):
+        clone = self._clone()
+        clone._eager = True
+        return clone
+
+    # Returns a new QuerySet that fetches the objects of the foreign keys on
+    # each path along with its rows, e.g. prefetch('user') on Account, or
+    # 'a__b' for the b of every a. The referenced rows of all the objects
+    # are fetched together, one get_many for each step of a path.
+    def prefetch(self, *paths):
+        for path in paths:
+            model = self.model
+            for name in path.split('__'):
+                model = foreign_model(model, name)
+        clone = self._clone()
+        clone._prefetch.extend(paths)
+        return clone
+
+    # Returns a new QuerySet without the rows that match the whole query.
+    def exclude(self, **kwarg):
+        predicates = self.model._predicates(kwarg)
+        self._check(predicates)
+        clone = self._clone()
+        if predicates:
+            clone._excludes.append(predicates)
+        return clone
+
+    # Returns the sorted primary keys of the matching rows. Every scan of the
+    # query is sent at once in a pipeline, then the id sets of the
+    # predicates are intersected smallest first and the excluded ids removed.
+    def pks(self):
+        if self._pk_cache is not None:
+            return self._pk_cache
+
+        table_name = self.model.__name__
+        predicates = self._predicates or [(None, operator.AL, None)]
+        if len(predicates) == 1 and not self._excludes:
+            columnname, op, value = predicates[0]
+            self._pk_cache = sorted(self._db.scan(table_name, op, columnname, value))
+            return self._pk_cache
+
+        with self._db.pipeline() as pipe:
+            futures = [pipe.scan(table_name, op, columnname, value)
+                       for columnname, op, value in predicates]
+            exclude_futures = [[pipe.scan(table_name, op, columnname, value)
+                                for columnname, op, value in excluded]
+                               for excluded in self._excludes]
+
+        result = intersect([future.result() for future in futures])
+        for excluded in exclude_futures:
+            if not result:
+                break
+            result.difference_update(
+                intersect([future.result() for future in excluded]))
+        self._pk_cache = sorted(result)
+        return self._pk_cache
+
+    # Returns the number of matching rows, from the scanned ids alone.
+    def count(self):
+        return len(self)
+
+    # Returns a dict of the aggregates over the matching rows, keyed like
+    # 'balance__sum'. Only the raw row values are read, batch_size rows per
+    # pipelined get_many, and folded in as they arrive.
+    def aggregate(self, *aggregates, batch_size=AGGREGATE_BATCH):
+        folder = Folder(self.model, aggregates)
+        if self._result_cache is not None:
+            for obj in self._result_cache:
+                folder.add(obj._get_field_values(format=True))
+            return folder.results()
+
+        pks = self.pks()
+        table_name = self.model.__name__
+        for start in range(0, len(pks), batch_size):
+            rows = self._db.get_many(table_name, pks[start:start+batch_size],
+                                     skip_missing=True)
+            for row in rows:
+                if row is not None:
+                    folder.add(row[0])
+        return folder.results()
+
+    def _fetch_all(self):
+        if self._result_cache is None:
+            self._result_cache = self._fetch(self.pks())
+        return self._result_cache
+
+    def __iter__(self):
+        return iter(self._fetch_all())
+
+    def __len__(self):
+        if self._result_cache is not None:
+            return len(self._result_cache)
+        return len(self.pks())
+
+    def __bool__(self):
+        return len(self) > 0
+
+    # Indexing and slicing fetch only the rows asked for, unless the
+    # QuerySet has been evaluated already.
+    def __getitem__(self, key):
+        if self._result_cache is not None:
+            return self._result_cache[key]
+        if isinstance(key, slice):
+            return self._fetch(self.pks()[key])
+        result = self._fetch([self.pks()[key]])
+        if not result:
+            # dropped since it was scanned
+            raise ObjectDoesNotExist
+        return result[0]
+
+    def _fetch(self, pks):
+        result = self.model._fetch(self._db, pks, self._session, self._eager)
+        for path in self._prefetch:
+            objects = result
+            model = self.model
+            for name in path.split('__'):
+                model = foreign_model(model, name)
+                objects = prefetch(self._db, self._session, objects, name, model)
+        return result
+
+# the table class a foreign key of model refers to
+def foreign_model(model, name):
+    for f_name, obj in model._fields:
+        if f_name == name and isinstance(obj, Foreign):
+            return type(model)._table(obj.table)
+    raise AttributeError
+
+# Fetch the objects that the foreign key name of objects refers to, in one
+# get_many of the rows not loaded yet, and resolve the References to them.
+# Returns the referenced objects.
+def prefetch(db, session, objects, name, model):
+    refs = [getattr(obj, name) for obj in objects]
+    pks = sorted(set([ref.pk for ref in refs
+                      if isinstance(ref, Reference) and not ref._loaded()]))
+    fetched = {obj.pk: obj for obj in model._fetch(db, pks, session)}
+    result = {}
+    for ref in refs:
+        if isinstance(ref, Reference):
+            if not ref._loaded():
+                if ref.pk not in fetched:
+                    raise ObjectDoesNotExist
+                ref._resolve(fetched[ref.pk])
+            ref = ref._load()
+        result[id(ref)] = ref
+    return list(result.values())
+
+# the ids found by every one of the scans, smallest first to keep the
+# intermediate sets small
+def intersect(id_lists):
+    id_lists = sorted(id_lists, key=len)
+    result = set(id_lists[0])
+    for ids in id_lists[1:]:
+        if not result:
+            break
+        result.intersection_update(ids)
+    return result
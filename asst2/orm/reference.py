@@ -0,0 +1,55 @@
+#!/usr/bin/python3
+#
+# reference.py
+#
+# Definition for Reference, the lazily loaded object of a foreign key
+#
+
+class Reference:
+    __slots__ = ('pk', '_model', '_db', '_session', '_target', '__weakref__')
+
+    # model: table class of the referenced row
+    # db: database object, the database to get the row from
+    # pk: int, primary key (ID) of the referenced row
+    # session: Session to load the row through, or None
+    def __init__(self, model, db, pk, session=None):
+        object.__setattr__(self, 'pk', pk)
+        object.__setattr__(self, '_model', model)
+        object.__setattr__(self, '_db', db)
+        object.__setattr__(self, '_session', session)
+        object.__setattr__(self, '_target', None)
+
+    # the referenced object, fetched on first use
+    def _load(self):
+        if self._target is None:
+            target = self._model.get(self._db, self.pk, self._session)
+            object.__setattr__(self, '_target', target)
+        return self._target
+
+    # everything but pk is read from and written to the referenced object
+    def __getattr__(self, name):
+        return getattr(self._load(), name)
+
+    def __setattr__(self, name, value):
+        if name == 'pk':
+            raise AttributeError
+        setattr(self._load(), name, value)
+
+    def __repr__(self):
+        return repr(self._load())
+
+    def __eq__(self, other):
+        if isinstance(other, Reference):
+            return self._model is other._model and self.pk == other.pk
+        return type(other) is self._model and other.pk == self.pk
+
+    def __hash__(self):
+        return hash((self._model, self.pk))
+
+    # whether the referenced object has been fetched
+    def _loaded(self):
+        return self._target is not None
+
+    # use target, fetched elsewhere, as the referenced object
+    def _resolve(self, target):
+        object.__setattr__(self, '_target', target)
@@ -0,0 +1,210 @@
+#!/usr/bin/python3
+#
+# session.py
+#
+# Definition for Session, an identity map of the objects loaded from a
+# database and a unit of work of the objects created or changed through it
+#
+
+import weakref
+from collections import deque
+from .query import QuerySet
+from .reference import Reference
+from .table import MetaTable, Table
+from .field import Foreign
+
+class Session:
+
+    # db: database object, the database to get the objects from
+    def __init__(self, db):
+        self.db = db
+        # (table class, pk) -> the one object of that row in this session,
+        # forgotten once nothing else refers to it
+        self._identity = weakref.WeakValueDictionary()
+        # (table class, pk) -> the Reference to a row not loaded yet
+        self._references = weakref.WeakValueDictionary()
+        # id -> object to insert on flush, and (table class, pk) -> changed
+        # object to update, both kept alive until written
+        self._new = {}
+        self._dirty = {}
+
+    def __repr__(self):
+        return "<ORM Session object>"
+
+    def __enter__(self):
+        return self
+
+    # writes the pending objects when the block succeeds
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is None:
+                self.flush()
+        finally:
+            self.clear()
+        return False
+
+    def __len__(self):
+        return len(self._identity)
+
+    def __contains__(self, obj):
+        return self._identity.get((type(obj), obj.pk)) is obj
+
+    # Returns the object of a row, fetched only if this session has not
+    # loaded it yet.
+    #   model: table class
+    #   pk: int, primary key (ID)
+    def get(self, model, pk):
+        return model.get(self.db, pk, self)
+
+    # Returns a QuerySet whose objects, and the objects they refer to, are
+    # shared with everything else loaded through this session.
+    def filter(self, model, **kwarg):
+        return QuerySet(model, self.db, self).filter(**kwarg)
+
+    # Track an object of the application. One without a primary key is
+    # inserted by the next flush, the changes to one that has a primary key
+    # are written by the flush after them.
+    def add(self, obj):
+        obj._session = self
+        if obj.pk is None:
+            self._new[id(obj)] = obj
+        else:
+            self._identity[(type(obj), obj.pk)] = obj
+
+    def add_all(self, objs):
+        for obj in objs:
+            self.add(obj)
+
+    # Forget an object, the next get fetches its row again and its pending
+    # insert or changes are not written.
+    def expunge(self, obj):
+        key = (type(obj), obj.pk)
+        if self._identity.get(key) is obj:
+            del self._identity[key]
+        if self._dirty.get(key) is obj:
+            del self._dirty[key]
+        self._new.pop(id(obj), None)
+        if obj._session is self:
+            obj._session = None
+
+    # Forget every object, pending inserts and changes are not written.
+    def clear(self):
+        for obj in list(self._identity.values()) + list(self._new.values()):
+            if obj._session is self:
+                obj._session = None
+        self._identity.clear()
+        self._references.clear()
+        self._new = {}
+        self._dirty = {}
+
+    # Write the pending objects: insert the new ones, and the unsaved objects
+    # their foreign keys refer to, and update the changed ones. Objects are
+    # written a level of the foreign key graph at a time, tables that refer
+    # to no other first, one pipeline per level. The primary keys of a level
+    # are filled in before the rows of the next level are encoded, so
+    # creating many users with their accounts takes two pipelines rather
+    # than two round trips per account.
+    # atomic: bool, updates fail if the row changed since it was loaded
+    def flush(self, atomic=True):
+        new = self._pending()
+        if not new and not self._dirty:
+            return
+
+        levels = table_levels()
+        by_level = {}
+        for obj in new:
+            by_level.setdefault(levels[type(obj)], ([], []))[0].append(obj)
+        for obj in list(self._dirty.values()):
+            by_level.setdefault(levels[type(obj)], ([], []))[1].append(obj)
+
+        for level in sorted(by_level):
+            inserts, updates = by_level[level]
+            with self.db.pipeline() as pipe:
+                insert_futures = [pipe.insert(obj._table_name, obj._row())
+                                  for obj in inserts]
+                update_futures = [pipe.update(obj._table_name, obj.pk, obj._row(),
+                                              obj.version if atomic else 0)
+                                  for obj in updates]
+            error = None
+            for obj, future in zip(inserts, insert_futures):
+                try:
+                    obj.pk, obj.version = future.result()
+                except Exception as e:
+                    if error is None:
+                        error = e
+                else:
+                    self._saved(obj)
+            for obj, future in zip(updates, update_futures):
+                try:
+                    obj.version = future.result()
+                except Exception as e:
+                    if error is None:
+                        error = e
+                else:
+                    self._saved(obj)
+            if error is not None:
+                # the objects not written stay pending
+                raise error
+
+    # the objects to insert, with the unsaved objects that the foreign keys
+    # of the pending objects refer to. They are visited in the order they
+    # were added, so the objects of a table are inserted in that order.
+    def _pending(self):
+        queue = deque(self._new.values())
+        queue.extend(self._dirty.values())
+        while queue:
+            obj = queue.popleft()
+            for name in obj._foreign_names:
+                value = getattr(obj, name)
+                if isinstance(value, Table) and value.pk is None and \
+                        id(value) not in self._new:
+                    value._session = self
+                    self._new[id(value)] = value
+                    queue.append(value)
+        return list(self._new.values())
+
+    # the object of a row if this session has it, else None
+    def _lookup(self, model, pk):
+        return self._identity.get((model, pk))
+
+    # the one Reference of this session to a row
+    def _reference(self, model, pk):
+        key = (model, pk)
+        result = self._references.get(key)
+        if result is None:
+            result = Reference(model, self.db, pk, self)
+            self._references[key] = result
+        return result
+
+    def _register(self, obj):
+        self._identity[(type(obj), obj.pk)] = obj
+
+    # called when a field of obj, an object of this session, is set
+    def _modified(self, obj):
+        if obj.pk is not None:
+            self._dirty[(type(obj), obj.pk)] = obj
+
+    # obj has been written, by flush or its own save
+    def _saved(self, obj):
+        key = (type(obj), obj.pk)
+        self._new.pop(id(obj), None)
+        if self._dirty.get(key) is obj:
+            del self._dirty[key]
+        self._identity[key] = obj
+
+# The level of every table class in the foreign key graph: 0 for a table
+# that refers to no other, else one more than the highest level of the
+# tables it refers to.
+def table_levels():
+    levels = {}
+
+    def level(model):
+        if model not in levels:
+            levels[model] = 1 + max([level(MetaTable._table(obj.table))
+                                     for name, obj in model._fields
+                                     if isinstance(obj, Foreign)], default=-1)
+        return levels[model]
+
+    for model in MetaTable.table_dict:
+        level(model)
+    return levels
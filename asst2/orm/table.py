@@ -10,7 +10,10 @@
 
 from collections import OrderedDict
 from datetime import datetime
-from .easydb import operator
+from .easydb import operator, ObjectDoesNotExist
+from .query import QuerySet
+from .reference import Reference
+from .codegen import make_init, make_row, make_hydrate
 from .field import Field, Integer, Float, String, Foreign, DateTime, Coordinate
 
 OP_DICT = {"ne": operator.NE, "gt": operator.GT, "lt": operator.LT, 'eq': operator.EQ,'al':operator.AL}
@@ -30,12 +33,9 @@ class MetaTable(type):
         if any( cls_name== i.__name__ for i in mcs.table_dict): #duplicate 
             raise AttributeError
 
-        cls = super().__new__(mcs, cls_name, bases, kwargs)
-
+        temp_f = []
+        temp_name = []
         if cls_name != "Table":
-            temp_f = []
-            temp_name = []
-            
             for name_att, type_att in kwargs.items():
                 if isinstance(type_att, Field):
                     special_w = ['pk','version','save','delete']
@@ -45,8 +45,30 @@ class MetaTable(type):
                     
                     temp_f.append((name_att, type_att))
                     temp_name.append(name_att)
-            
+
+            # values live in the slots of each field, named '_' + name and
+            # longer, that cannot clash with a field since field names have
+            # no underscore
+            slots = list(kwargs.get('__slots__', ()))
+            for name_att, type_att in temp_f:
+                slots.extend(type_att._slot_names(name_att))
+            kwargs['__slots__'] = tuple(slots)
+
+        cls = super().__new__(mcs, cls_name, bases, kwargs)
+
+        if cls_name != "Table":
+            for name_att, type_att in temp_f:
+                type_att._bind(cls, name_att)
             cls._fields = temp_f
+            cls._field_names = temp_name
+            cls._foreign_names = [name_att for name_att, type_att in temp_f
+                                  if isinstance(type_att, Foreign)]
+            cls._table_name = cls_name
+            # constructor and row flattener specialized to the fields
+            if '__init__' not in kwargs:
+                cls.__init__ = make_init(temp_f)
+            cls._row = make_row(temp_f)
+            cls._hydrate = staticmethod(make_hydrate(cls, temp_f, mcs._reference))
             mcs.table_dict.append(cls)
 
         return cls
@@ -55,97 +77,160 @@ class MetaTable(type):
     # Returns an existing object from the table, if it exists.
     #   db: database object, the database to get the object from
     #   pk: int, primary key (ID)
-    def get(cls, db, pk):
+    #   session: Session, returns its object of the row if it has one
+    #   eager: bool, fetch the objects that foreign keys refer to now rather
+    #     than on first access
+    def get(cls, db, pk, session=None, eager=False):
 
+        if session is not None:
+            result = session._lookup(cls, pk)
+            if result is not None:
+                return result
         values, version = db.get(cls.__name__,pk)
-        kwargs = {}  
+        return cls._fetch_foreign(db, [(pk, values, version)], session, eager)[0]
+
+    # Returns the objects with primary keys pks that still exist, in order.
+    # The rows are read with one pipelined get_many, and so are the rows
+    # their foreign keys refer to when eager, one batch per foreign key
+    # column. Rows the session has loaded already are not fetched again.
+    def _fetch(cls, db, pks, session=None, eager=False):
+
+        found = {}
+        missing = pks
+        if session is not None:
+            for pk in pks:
+                obj = session._lookup(cls, pk)
+                if obj is not None:
+                    found[pk] = obj
+            missing = [pk for pk in pks if pk not in found]
+        if missing:
+            rows = db.get_many(cls.__name__, missing, skip_missing=True)
+            rows = [(pk, row[0], row[1]) for pk, row in zip(missing, rows)
+                    if row is not None]
+            for obj in cls._fetch_foreign(db, rows, session, eager):
+                found[obj.pk] = obj
+        return [found[pk] for pk in pks if pk in found]
+
+    # Build objects from (pk, values, version) rows. When eager the objects
+    # their foreign keys refer to are fetched as well, else the foreign keys
+    # are References that fetch on first access.
+    def _fetch_foreign(cls, db, rows, session=None, eager=False):
+
+        foreign = {}
         index = 0
         for f_name, obj in cls._fields:
-            if isinstance(obj,Foreign):
-                object=[]
-                for eachC in MetaTable.table_dict:
-                    if eachC.__name__ == obj.table.__name__:
-                        object = eachC
-                f_obj= object.get(db,values[index])
-                kwargs[f_name] = f_obj
-                index+=1
-            elif type(obj) is Coordinate:
-                kwargs[f_name] = (values[index], values[index+1]) #2-tuple -> 2 values
-                index+=2
-            elif type(obj) is DateTime:
-                kwargs[f_name] = datetime.fromtimestamp(values[index]) #float -> datetime
-                index +=1
-            else:
-                kwargs[f_name] = values[index]
-                index+=1
+            if isinstance(obj,Foreign) and eager:
+                ref_pks = sorted(set(row[1][index] for row in rows))
+                refs = MetaTable._table(obj.table)._fetch(db, ref_pks, session, eager)
+                if len(refs) != len(ref_pks):
+                    # referenced row dropped since, as get would
+                    raise ObjectDoesNotExist
+                foreign[index] = {ref.pk: ref for ref in refs}
+            index += 2 if type(obj) is Coordinate else 1
 
-        result = cls(db, **kwargs)
-        result.pk = pk
-        result.version = version
-        
+        result = [cls._from_row(db, pk, values, version, foreign, session)
+                  for pk, values, version in rows]
+        if session is not None:
+            for obj in result:
+                session._register(obj)
         return result
 
-    # Returns a list of objects that matches the query. If no argument is given,
-    # returns all objects in the table.
+    # the registered table class named like table
+    @staticmethod
+    def _table(table):
+        for eachC in MetaTable.table_dict:
+            if eachC.__name__ == table.__name__:
+                return eachC
+        return table
+
+    # the object of a foreign key value, the session's if it has loaded it
+    @staticmethod
+    def _reference(table, db, pk, session):
+        model = MetaTable._table(table)
+        if session is not None:
+            result = session._lookup(model, pk)
+            if result is not None:
+                return result
+            return session._reference(model, pk)
+        return Reference(model, db, pk)
+
+    # Build an object from the values of its row. foreign maps the index of
+    # each fetched foreign key value to the referenced objects by primary
+    # key, other foreign keys become References. The values come from the
+    # database, so they are not checked again as the constructor would.
+    def _from_row(cls, db, pk, values, version, foreign, session=None):
+
+        return cls._hydrate(db, pk, version, values, foreign, session)
+
+    # Returns a QuerySet of the objects that match the query. If no argument
+    # is given, it holds all objects in the table. Nothing is sent to the
+    # database until the QuerySet is iterated, indexed, sliced or len()'d.
     # db: database object, the database to get the object from
     # kwarg: the query argument for comparing
     def filter(cls, db, **kwarg):
 
-        result = []
+        return QuerySet(cls, db).filter(**kwarg)
 
-        if len(kwarg) ==0:
-            #Case: empty input
-            pks = db.scan(cls.__name__, OP_DICT['al'])
-            result = [cls.get(db,eachPk) for eachPk in pks] 
-        else:
-            for c_op, value in kwarg.items():
-                if '__' in c_op:
-                    columnname,op = c_op.split('__')
-                    if op not in OP_DICT.keys() or not(columnname == 'id' or any(columnname == f_name for f_name,obj in cls._fields)):
-                        raise AttributeError             
-                else:
-                    #Case: eq and foreign 
-                    columnname = c_op
-                    op = 'eq'
-                    if isinstance(value,Table):
-                        value = value.pk                 
-                
-                if type(value) is tuple: #Coordinate
-                    pk1 = db.scan(cls.__name__, OP_DICT[op],columnname+'_lat',value[0])
-                    pk2 = db.scan(cls.__name__, OP_DICT[op],columnname+'_long',value[1])
-                    pks = sorted(set(pk1).intersection(set(pk2)))
-                else:
-                    if isinstance(value,datetime):
-                        value = value.timestamp()  #datetime -> float       
-                    pks = db.scan(cls.__name__, OP_DICT[op],columnname,value)
-               
-                result = [cls.get(db,eachPk) for eachPk in pks] 
+    # Turn the query arguments into the scans that answer them, as
+    # (column name, operator, value). A Coordinate needs a scan per value.
+    def _predicates(cls, kwarg):
 
-        return result
+        predicates = []
+        for c_op, value in kwarg.items():
+            if '__' in c_op:
+                columnname,op = c_op.split('__')
+                if op not in OP_DICT.keys() or not(columnname == 'id' or any(columnname == f_name for f_name,obj in cls._fields)):
+                    raise AttributeError             
+            else:
+                #Case: eq and foreign 
+                columnname = c_op
+                op = 'eq'
+            if isinstance(value,(Table,Reference)):
+                value = value.pk                 
+            
+            if type(value) is tuple: #Coordinate
+                predicates.append((columnname+'_lat', OP_DICT[op], value[0]))
+                predicates.append((columnname+'_long', OP_DICT[op], value[1]))
+            else:
+                if isinstance(value,datetime):
+                    value = value.timestamp()  #datetime -> float       
+                predicates.append((columnname, OP_DICT[op], value))
+
+        return predicates
 
     # Returns the number of matches given the query. If no argument is given, 
     # return the number of rows in the table.
     # db: database object, the database to get the object from
     # kwarg: the query argument for comparing
+    # Only the ids are scanned, no row is fetched.
     def count(cls, db, **kwarg):
      
-        obj_list = cls.filter(db, **kwarg)
-        result = len(obj_list)
-       
-        return result
+        return cls.filter(db, **kwarg).count()
+
+    # Returns a dict of aggregates over the rows that match the query, e.g.
+    # Account.aggregate(db, Sum('balance'), Max('balance'), type="Savings")
+    # gives {'balance__sum': ..., 'balance__max': ...}. No objects are built.
+    # db: database object, the database to get the rows from
+    # aggregates: Sum, Min, Max or Avg of a field
+    # kwarg: the query argument for comparing
+    def aggregate(cls, db, *aggregates, **kwarg):
+
+        return cls.filter(db, **kwarg).aggregate(*aggregates)
 
 # table class
 # Implement me.
 class Table(object, metaclass=MetaTable):
+    # fields are stored in slots that MetaTable adds to each table class,
+    # _session is the Session that writes the changes of the object
+    __slots__ = ('pk', 'version', '_db', '_session', '__weakref__')
 
     def __init__(self, db, **kwargs):
         self.pk = None      # id
         self.version = None # version
         self._db = db
-        self._table_name = self.__class__.__name__
+        self._session = None
 
         fields = self.__class__._fields
-        field_names = []
         for name, obj in fields:
             should_be_specified = not obj.blank and obj.default is None
 
@@ -155,42 +240,24 @@ class Table(object, metaclass=MetaTable):
                 setattr(self, name, None)
                 if should_be_specified:
                     raise AttributeError
-            field_names.append(name)
- 
-        self._field_names = field_names
 
+    # The values of the fields, or with format the values of the row as
+    # sent to the database.
     def _get_field_values(self, format=False):
-        values = []
-        for name in self._field_names:
-            value = getattr(self, name)
-            
-            if format:
-                if isinstance(value, Table):
-                    values.append(value.pk)
-                else:
-                    if type(value) is tuple: #coordinate 
-                        values.append(value[0])
-                        values.append(value[1])
-                    else:
-                        if type(value) is datetime:
-                            value = value.timestamp()
-                        values.append(value)
-            else:
-                values.append(value)
-
-        return values
+        if format:
+            return self._row()
+        return [getattr(self, name) for name in self._field_names]
 
     # Save the row by calling insert or update commands.
     # atomic: bool, True for atomic update or False for non-atomic update
     def save(self, atomic=True):
-        values = self._get_field_values()
-
-        for value in values:
+        for name in self._foreign_names:
+            value = getattr(self, name)
             if isinstance(value, Table): # check foreign key
                 if value.pk is None: # save the referenced obj first
                     value.save(atomic)
 
-        formatted_field_values = self._get_field_values(format=True)
+        formatted_field_values = self._row()
         if self.pk is None:
             self.pk, self.version = self._db.insert(self._table_name, formatted_field_values)
             
@@ -199,10 +266,14 @@ class Table(object, metaclass=MetaTable):
             if atomic:
                 args.append(self.version)
             self.version = self._db.update(*args)
+        if self._session is not None:
+            self._session._saved(self)
 
     # Delete the row from the database.
     def delete(self):
         self._db.drop(self._table_name, self.pk)
+        if self._session is not None:
+            self._session.expunge(self)
         self.pk = None
         self.version = None
 
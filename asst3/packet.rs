@@ -196,11 +196,11 @@ impl Buffer for ByteArray {
     }
 }
 
-/* create packet from a byte array */
-impl From<& [u8; ByteArray::MAX_PACKET_SIZE]> for ByteArray {
-    fn from(buf: & [u8; ByteArray::MAX_PACKET_SIZE]) -> Self {
+/* create packet from the raw bytes of one request */
+impl From<Vec<u8>> for ByteArray {
+    fn from(buf: Vec<u8>) -> Self {
         ByteArray {
-            buffer: buf.to_vec(),
+            buffer: buf,
             pointer: 0,
             strlen: 0,
         }
@@ -347,14 +347,73 @@ impl In<String> for ByteArray {
 
 pub trait Network : io::Write + io::Read {
 
+    /* append exactly size bytes from the stream to buffer */
+    fn read_bytes(&mut self, buffer: &mut Vec<u8>, size: usize) 
+        -> io::Result<()> 
+    {
+        let start = buffer.len();
+        if start + size > ByteArray::MAX_PACKET_SIZE {
+            return Err(io::Error::new(io::ErrorKind::Other,
+                       "Packet too large"));
+        }
+        buffer.resize(start + size, 0);
+        self.read_exact(&mut buffer[start..])
+    }
+    
+    fn read_i32(&mut self, buffer: &mut Vec<u8>) -> io::Result<i32> {
+        const SIZE: usize = mem::size_of::<i32>();
+        self.read_bytes(buffer, SIZE)?;
+        let mut arr : [u8; SIZE] = [0; SIZE];
+        arr.copy_from_slice(&buffer[buffer.len()-SIZE..]);
+        Ok(i32::from_be_bytes(arr))
+    }
+    
+    /* type, size and value field of one value */
+    fn read_value_bytes(&mut self, buffer: &mut Vec<u8>) -> io::Result<()> {
+        self.read_i32(buffer)?;
+        let size = self.read_i32(buffer)?;
+        if size < 0 {
+            return Err(io::Error::new(io::ErrorKind::Other,
+                       "Read invalid value size"));
+        }
+        self.read_bytes(buffer, size as usize)
+    }
+    
+    /* read the bytes of exactly one request, so that requests the client 
+     * pipelined behind it stay in the stream for the next receive */
+    fn read_request(&mut self) -> io::Result<Vec<u8>> {
+        let mut buffer = Vec::<u8>::with_capacity(64);
+        let cmd = self.read_i32(&mut buffer)?;
+        self.read_i32(&mut buffer)?;    /* table id */
+        
+        match cmd {
+            Request::INSERT | Request::UPDATE => {
+                if cmd == Request::UPDATE {
+                    /* id, version */
+                    self.read_bytes(&mut buffer, 2*mem::size_of::<i64>())?;
+                }
+                let numcols = self.read_i32(&mut buffer)?;
+                for _ in 0..numcols {
+                    self.read_value_bytes(&mut buffer)?;
+                }
+            },
+            Request::DROP | Request::GET => {
+                self.read_bytes(&mut buffer, mem::size_of::<i64>())?;
+            },
+            Request::SCAN => {
+                /* column id, operator */
+                self.read_bytes(&mut buffer, 2*mem::size_of::<i32>())?;
+                self.read_value_bytes(&mut buffer)?;
+            },
+            _ => {},
+        };
+        
+        Ok(buffer)
+    }
+
     /* receive a packet from client */
     fn receive(&mut self) -> io::Result<Request> { 
-        let mut buffer : [u8; ByteArray::MAX_PACKET_SIZE] = unsafe {
-            mem::MaybeUninit::uninit().assume_init()
-        };
-      
-        self.read(&mut buffer)?;
-        let mut packet = ByteArray::from(&buffer);
+        let mut packet = ByteArray::from(self.read_request()?);
         let cmd = packet.read()?;
         use self::Command::*;
        
@@ -465,7 +524,8 @@ pub trait Network : io::Write + io::Read {
             },
         };
         
-        self.write(&packet.buffer)
+        self.write_all(&packet.buffer)?;
+        Ok(packet.buffer.len())
     }
 }
 
@@ -122,6 +122,9 @@ fn handle_connection(mut stream: TcpStream, db_in: & mut std::sync::Arc<std::syn
      *       4 simultaneous clients.
      */
     stream.respond(&Response::Connected)?;
+    
+    /* responses to pipelined requests go out without waiting for an ack */
+    stream.set_nodelay(true)?;
 
     loop {
         let request = match stream.receive() {